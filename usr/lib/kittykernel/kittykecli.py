@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+#  kittykernel
+#  
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#  
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#  
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#  
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Non-interactive command line interface of kittykernel (list, install,
+#  remove, purge, autoclean), e.g.  for scripts running on many machines.
+#  No GTK3 or urwid stuff is allowed here!
+#
+# 
+#  Warning: Don't read this  source file if  you are annoyed by too many
+#           comments. Read source code  of other FOSS projects  instead.
+#
+
+import sys
+import json
+import kittykecore
+
+
+# Attributes of a kernel, which are shown in the output
+output_attributes = ['package', 'version_major', 'version', 'pkg_version', 'active', 'installed', 'downloaded', 'size', 'installed_size', 'origins']
+
+# Returns the attributes of a kernel, which are shown in the output, as dictionary; installed kernels have their
+# footprint on disk as well (see kittykecore.get_kernel_footprints), i.e. the bytes in /boot and elsewhere
+def get_kernel_output(kernel, footprints = {}):
+    output = {name: getattr(kernel, name) for name in output_attributes}
+
+    footprint = footprints.get(kernel.package, None)
+    output['boot_bytes'] = [footprint['boot'] if footprint is not None else None][0]
+    output['other_bytes'] = [footprint['other'] if footprint is not None else None][0]
+
+    return output
+
+# Prints the result of a command: as JSON or as simple text. 'lines' is only used for the text.
+def print_result(args, result, lines):
+    if args["json"]:
+        print(json.dumps(result, indent = 2, sort_keys = True))
+    else:
+        for line in lines:
+            print(line)
+
+# Shows the progress of a transaction; only if someone is watching (stderr is a terminal), so scripts get clean output
+def print_progress(fraction, status):
+    if sys.stderr.isatty():
+        print("\r[%3d%%] %-70s" % (int(fraction * 100), status[:70]), end = "\n" if fraction >= 1.0 else "", file = sys.stderr)
+
+# Returns the text line of a kernel for the list
+def get_kernel_line(kernel, footprints = {}):
+    flags = [flag for flag in ['active', 'installed', 'downloaded'] if getattr(kernel, flag)]
+
+    line = "%-45s %-28s %-28s" % (kernel.package, [kernel.pkg_version if len(kernel.pkg_version) > 0 else "-"][0], ",".join(flags))
+
+    if kernel.package in footprints:
+        line += " /boot: %s, other: %s" % (kittykecore.sizeof_fmt(footprints[kernel.package]['boot']), kittykecore.sizeof_fmt(footprints[kernel.package]['other']))
+
+    return line.rstrip()
+
+# Lists the kernels
+def command_list(args):
+    kernels = kittykecore.get_kernels()
+
+    if not args["all"]:
+        kernels = kittykecore.apply_blacklist(kernels, kittykecore.load_blacklist())
+
+    if args["installed"]:
+        kernels = [kernel for kernel in kernels if kernel.installed]
+
+    footprints = kittykecore.get_kernel_footprints(kernels)
+
+    print_result(args, [get_kernel_output(kernel, footprints) for kernel in kernels], [get_kernel_line(kernel, footprints) for kernel in kernels])
+
+    return 0
+
+# Asks before doing a plan, which removes packages nobody asked for (see kittykecore.plan_operations); --yes answers
+# for scripts. Without a terminal to ask (and without --yes), such plans are refused.
+def confirm_plan(args, plan):
+    if plan is None or len(plan['extra_remove']) == 0 or args.get("yes", False):
+        return True
+
+    if not sys.stdin.isatty():
+        return False
+
+    print("Continue? [y/N] ", end = "", file = sys.stderr, flush = True)
+
+    return sys.stdin.readline().strip().lower() in ['y', 'yes']
+
+# Installs, removes, or purges kernels (with their headers and extras if wanted); the active kernel is never removed.
+# The operations are planned first (see kittykecore.plan_operations) and refused if they do not fit (error code -5);
+# the plan is shown before anything is done and plans, which remove other packages as well, have to be confirmed
+# (error code -6 if not). With --dry-run, only the plan is shown.
+def perform(args, verb, packages, headers = True, extras = True):
+    kernels = {kernel.package: kernel for kernel in kittykecore.get_kernels()}
+
+    unknown = [package for package in packages if package not in kernels]
+    refused = [package for package in packages if package in kernels and kernels[package].active and verb != 'install']
+    packages = [package for package in packages if package in kernels and package not in refused]
+
+    dry_run = args.get("dry_run", False)
+
+    result = 0
+    plan = None
+    shown = False
+    errors = []
+    if len(packages) > 0:
+        plan = kittykecore.plan_kernels(packages, verb, headers = headers, extras = extras)
+
+        if plan is not None and not plan['fits']:
+            result = -5
+        elif not dry_run:
+            # Show the plan before anything is done; with --json on stderr, so stdout stays valid JSON
+            if plan is not None:
+                print(kittykecore.get_plan_summary(plan), file = [sys.stderr if args["json"] else sys.stdout][0])
+                shown = True
+
+            if confirm_plan(args, plan):
+                result = kittykecore.perform_kernels(packages, verb, headers = headers, extras = extras, backend = args["backend"], progress = print_progress, errors = errors)
+            else:
+                result = -6
+
+    lines = ["%s%s: %s" % (verb, [" (dry run)" if dry_run else ""][0], package) for package in packages] + \
+            ["Unknown kernel: %s" % package for package in unknown] + \
+            ["The active kernel cannot be removed: %s" % package for package in refused]
+
+    if plan is not None and not shown:
+        lines.append(kittykecore.get_plan_summary(plan))
+
+    if result == -6:
+        lines.append("Cancelled: other packages would be removed as well (use --yes to allow this)")
+    elif result != 0:
+        lines.append("Operation failed (error code %d)" % result)
+
+    lines += ["Error: %s" % error for error in errors]
+
+    print_result(args, {'command': verb, 'packages': packages, 'unknown': unknown, 'refused': refused, 'result': result,
+                        'dry_run': dry_run, 'plan': plan, 'errors': errors}, lines)
+
+    return [0 if result == 0 and len(unknown) == 0 and len(refused) == 0 else 1][0]
+
+# Installs, removes, or purges the kernels given
+def command_perform(args):
+    return perform(args, args["command"], args["packages"], headers = not args["no_headers"], extras = not args["no_extras"])
+
+# Purges all kernels, which are not needed according to the retention policy (see kittykecore.get_autoclean_kernels),
+# in one transaction; --keep overrides the number of kernels kept per flavour
+def command_autoclean(args):
+    policy = kittykecore.get_autoclean_policy()
+
+    if args["keep"] is not None:
+        policy['keep'] = max(0, args["keep"])
+
+    packages = [kernel.package for kernel in kittykecore.get_autoclean_kernels(kittykecore.get_kernels(), policy)]
+
+    return perform(args, 'purge', packages)
+
+# Runs the command given on the command line (see kittykernel.py); returns the exit code
+def run(args):
+    commands = {'list': command_list, 'install': command_perform, 'remove': command_perform, 'purge': command_perform,
+                'autoclean': command_autoclean}
+
+    try:
+        # The running kernel booted fine
+        kittykecore.record_known_good_kernel()
+
+        return commands[args["command"]](args)
+
+    except Exception as e:
+        print(e, file = sys.stderr)
+        return 2
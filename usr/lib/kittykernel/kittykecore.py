@@ -29,6 +29,7 @@
 import os
 import subprocess
 import apt
+import apt.progress.base
 import sys
 import platform
 import tempfile
@@ -37,17 +38,58 @@ import re
 import datetime
 import configparser
 import urllib
+import urllib.request
+import urllib.error
+import concurrent.futures
+import hashlib
+import json
+import time
+import threading
+import email.utils
+import collections
+import functools
+import mmap
 _ = gettext.gettext
 
 
 # Debug mode; show exception data when set to True
 debugmode = False
 
-# APT Cache object
-cache = apt.Cache()
+# APT Cache object; opened when first needed (see get_cache), so kittykernel does not need to open the cache at all
+# if the kernel list can be taken from the snapshot (see get_kernels)
+cache = None
+cache_fingerprint = ""
+cache_lock = threading.Lock()
+
+# Snapshot of the kernel list; only valid as long as the state of APT/dpkg does not change (see get_apt_fingerprint)
+kernel_snapshot_file = os.path.expanduser("~/.config/kittykernel/kernels.json")
+
+# Format of the snapshot; snapshots with another format are ignored (e.g. if kernels are sorted differently)
+kernel_snapshot_format = 3
+
+# Running kernel and size of /boot (free, total); determined when first needed (see get_current_kernel and sizeof_boot)
+current_kernel = None
+boot_size = None
+
+# Files in /boot, which belong to a kernel release, e.g. "initrd.img-4.15.0-29-generic" (see get_boot_usages)
+boot_file_pattern = re.compile(u"^[^-]+-([0-9].*?)(?:\\.efi\\.signed)?$")
+
+# Space a kernel needs in /boot if there is no other kernel to compare with (see plan_operations) and space, which
+# should be always left free in /boot
+boot_usage_default = 70*1024*1024
+boot_reserve = 10*1024*1024
+
+# Footprints of installed kernels on disk (see get_kernel_footprint); saved in ~/.config/kittykernel/footprint.json
+# and loaded when first needed. The files of a kernel are read by footprint_workers threads at the same time.
+dpkg_info_path = "/var/lib/dpkg/info"
+footprint_cache = None
+footprint_cache_file = os.path.expanduser("~/.config/kittykernel/footprint.json")
+footprint_cache_lock = threading.Lock()
+footprint_workers = 8
 
 # Architecture of platform; 64bit?
 platformis64bit = (platform.architecture()[0] == "64bit")
+dpkg_architecture = ['amd64' if platformis64bit else 'i386'][0]
 
 # Default config
 config_default = {
@@ -59,9 +101,93 @@ config_default = {
          'expired': '#600000',
          'toexpire': '#606000'},
     'Checks':
-        {'kittywarning': ''}
+        {'kittywarning': ''},
+    'Mainline':
+        {'workers': '8'},
+    'Cache':
+        {'maxsize': '104857600',
+         'maxage': '180'},
+    'Packages':
+        {'backend': 'auto'},
+    'Autoclean':
+        {'keep': '1',
+         'keep_known_good': 'yes'}
     }
 
+# Kernels, which were running when kittykernel was started (i.e. they booted fine), oldest first; only the last
+# known_good_size kernels are remembered (see record_known_good_kernel)
+known_good_file = os.path.expanduser("~/.config/kittykernel/known_good")
+known_good_size = 10
+
+# Backends for changing packages (see pkg_perform_operations): 'synaptic' (pkexec synaptic with a selections file),
+# 'apt' (python-apt marks the packages and commits them; needs root), and 'apt-get' (pkexec apt-get if not root).
+# 'auto' uses 'apt' for root and 'apt-get' otherwise.
+package_backends = ['auto', 'synaptic', 'apt', 'apt-get']
+
+# Path of the metadata cache for the Ubuntu mainline archive
+http_cache_path = os.path.expanduser("~/.config/kittykernel/httpcache")
+
+# Files of a version directory on the Ubuntu mainline archive never change once they are uploaded; however,
+# a directory could be still in the process of being filled. Hence, files are only regarded as immutable
+# when they were not modified within this time (in seconds)
+http_cache_grace = 24*60*60
+
+# Size of the blocks in which files are downloaded
+download_block_size = 64*1024
+
+# Size of the blocks in which files are read for calculating checksums
+checksum_block_size = 1024*1024
+
+# Checksums of files, which were verified before; key is (path, mtime, size, algorithm), value is the hex digest;
+# saved in ~/.config/kittykernel/digests and loaded when first needed
+digest_cache = None
+digest_cache_file = os.path.expanduser("~/.config/kittykernel/digests")
+digest_cache_lock = threading.Lock()
+
+# Number of changelogs, which are downloaded at the same time (see ChangelogStore)
+changelog_workers = 4
+
+# CHANGES files of Ubuntu mainline kernels, which were loaded recently (url => text); least recently used first
+ubuntu_changes_cache = collections.OrderedDict()
+ubuntu_changes_cache_size = 32
+ubuntu_changes_lock = threading.Lock()
+
+
+# File of an Ubuntu mainline kernel: name, date (as shown in the directory listing), and size in bytes
+KernelFile = collections.namedtuple('KernelFile', ['name', 'date', 'size'])
+
+# Information about a kernel package from the repository or the Ubuntu mainline archive; the last five attributes
+# are only used for Ubuntu mainline kernels ('files' is a tuple of KernelFile)
+class KernelRecord():
+    __slots__ = ('version_major', 'version', 'package', 'pkg_version', 'size', 'installed_size', 'origins', 'fullname',
+                 'active', 'installed', 'downloaded', 'url', 'changes_url', 'checksums_url', 'files', 'downloaded_files')
+
+    # Default values of all attributes
+    defaults = {'version_major': '', 'version': '', 'package': '', 'pkg_version': '', 'size': 0, 'installed_size': 0, 'origins': '', 'fullname': '',
+                'active': False, 'installed': False, 'downloaded': False, 'url': '', 'changes_url': '', 'checksums_url': '', 'files': (), 'downloaded_files': 0}
+
+    def __init__(self, **attributes):
+        for name in self.__slots__:
+            setattr(self, name, attributes.get(name, self.defaults[name]))
+
+    def __repr__(self):
+        return "KernelRecord(%r)" % self.package
+
+    # Returns a copy of this record
+    def copy(self):
+        return KernelRecord(**self.to_dict())
+
+    # Returns all attributes as dictionary (e.g. for saving as JSON)
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    # Creates a record from a dictionary (see to_dict)
+    @staticmethod
+    def from_dict(attributes):
+        record = KernelRecord(**attributes)
+        record.files = tuple([KernelFile(*file) for file in record.files])
+        return record
+
 
 # Convert a number of bytes to a string with respective quantities. This
 # uses SI units (Ki, Mi, etc); implementation from Stackflow (Fred Cirera)
@@ -75,26 +201,21 @@ def sizeof_fmt(num, suffix='B'):
 
 
 # This function returns the size in bytes of the /boot directory/partition
-# as tuple: (free, total); returns (0, 0) when something went wrong
+# as tuple: (free, total); returns (0, 0) when something went wrong. The
+# result is kept until package operations change /boot (see pkg_perform_operations)
 def sizeof_boot():
-    global debugmode
-    try:
-        # call df to get the size of /boot
-        output_lines = subprocess.check_output("df -B 1 /boot", shell = True).decode("utf-8").strip().split('\n')
+    global debugmode, boot_size
 
-        # Should be at least two lines
-        if len(output_lines) < 2:
-            return (0, 0)
+    if boot_size is not None:
+        return boot_size
 
-        # Get second line and split
-        columns = list(filter(None, output_lines[1].split(' ')))
+    try:
+        # Same numbers as 'df -B 1 /boot' shows: available space (for normal users) and total space
+        stats = os.statvfs("/boot")
 
-        # There should be at least 4 columns
-        if len(columns) < 4:
-            return (0, 0)
+        boot_size = (stats.f_bavail * stats.f_frsize, stats.f_blocks * stats.f_frsize)
 
-        # Return the 4th column (free space) and the 2nd column (total space) as integers
-        return (int(columns[3]), int(columns[1]))
+        return boot_size
 
     # When something went really wrong...
     except Exception as e:
@@ -102,6 +223,12 @@ def sizeof_boot():
             print (e)
         return (0, 0)
 
+# Forgets the size of /boot (see sizeof_boot), e.g. after kernels were installed or removed
+def invalidate_sizeof_boot():
+    global boot_size
+
+    boot_size = None
+
 # Opens and loads the config file from ~/.config/kittykernel/config and returns its entries as dictionaries; will return a dictionary with defaults if no file exists
 def load_config():
     global debugmode
@@ -144,37 +271,199 @@ def save_config(options):
         config.write(configfile)
 
 
-# Compares version numbers; adaptation of Stackflow https://stackoverflow.com/questions/1714027/version-number-comparison-in-python
+# Parsed version number such as "4.15" or "4.15.0-24.26~16.04.1"; versions are compared by their numbers (so "4.4" is
+# older than "4.15"), trailing zeros do not matter ("4.10.0" equals "4.10"), an epoch ("1:...") counts first, and
+# everything after a '~' makes a version older as in Debian ("4.15.0-24.26~16.04.1" is older than "4.15.0-24.26").
+# Use parse_version to get (cached) objects.
+@functools.total_ordering
+class Version():
+    __slots__ = ('string', 'key')
+
+    def __init__(self, string):
+        self.string = string
+
+        # Epoch
+        epoch = 0
+        if ':' in string and string.split(':', 1)[0].strip().isdigit():
+            epoch, string = string.split(':', 1)
+            epoch = int(epoch)
+
+        # Numbers of the version and of each part after a '~'; versions without '~' are newer, so they end with (1,)
+        # while each part after a '~' is (0, numbers)
+        parts = string.split('~')
+        tildes = tuple([(0, Version.numbers(part)) for part in parts[1:]]) + ((1,),)
+
+        self.key = (epoch, Version.numbers(parts[0]), tildes)
+
+    # Returns all numbers in a string as tuple of ints without trailing zeros
+    @staticmethod
+    def numbers(string):
+        numbers = [int(x) for x in re.findall(u"[0-9]+", string)]
+
+        while len(numbers) > 0 and numbers[-1] == 0:
+            del numbers[-1]
+
+        return tuple(numbers)
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return "Version(%r)" % self.string
+
+# Returns the parsed version of a string (see Version); results are cached, since the same versions are compared
+# again and again
+@functools.lru_cache(maxsize = 4096)
+def parse_version(version):
+    return Version(version)
+
+# Compares version numbers; returns 1 if version1 is newer, -1 if version2 is newer, and 0 if both are equal
 def compare_versions(version1, version2):    
-    def compare(a, b):
-        return (a > b) - (a < b) 
-
-    def normalize(v):
-        return [int(x) for x in re.sub(r'(\.0+)*$','', v).split(".")]
-        
-    return compare(normalize(version1), normalize(version2))
-
-# Updates and reopens the cache; this version uses synaptic
-def refresh_cache(xwindow_id = 0):
-    global cache
-    # Starting synaptic with all the necessary parameters
-    cmd = ["pkexec", "/usr/sbin/synaptic", "--hide-main-window", "--update-at-startup", "--non-interactive", "--parent-window-id", "%d" % xwindow_id]
-    comnd = subprocess.Popen(' '.join(cmd), shell=True)
-    comnd.wait()
+    version1 = parse_version(version1)
+    version2 = parse_version(version2)
+
+    return (version1 > version2) - (version1 < version2) 
+
+# Updates and reopens the cache; uses the same backend as for changing packages (see get_package_backend)
+def refresh_cache(xwindow_id = 0, backend = None):
+    global debugmode
+
+    backend = get_package_backend(backend)
+
+    if backend == 'synaptic':
+        # Starting synaptic with all the necessary parameters
+        cmd = ["pkexec", "/usr/sbin/synaptic", "--hide-main-window", "--update-at-startup", "--non-interactive", "--parent-window-id", "%d" % xwindow_id]
+        comnd = subprocess.Popen(' '.join(cmd), shell=True)
+        comnd.wait()
+
+    # python-apt (root only)
+    elif backend == 'apt':
+        try:
+            get_cache().update()
+        except Exception as e:
+            if debugmode:
+                print (e)
+
+    else:
+        subprocess.call(get_privileged_command(["apt-get", "-q", "update"]))
 
     # Reopens the list; necessary after updating
-    cache.open(None)
+    reopen_cache()
+
+# Returns the APT cache object; opens the cache if this was not done before
+def get_cache():
+    global cache, cache_fingerprint
+
+    with cache_lock:
+        if cache is None:
+            cache_fingerprint = get_apt_fingerprint()
+            cache = apt.Cache()
+
+        return cache
 
-# Just rereads the cache (reopens)
-def reopen_cache():
-    cache.open(None)
+# Rereads the cache (reopens); this is only done if the cache was opened before and the state of APT/dpkg changed
+# in the meantime (or if 'force' is set)
+def reopen_cache(force = False):
+    global cache_fingerprint
+
+    with cache_lock:
+        if cache is None:
+            return
+
+        fingerprint = get_apt_fingerprint()
+
+        if force or fingerprint != cache_fingerprint:
+            cache_fingerprint = fingerprint
+            cache.open(None)
+
+# Returns a fingerprint (hash) of the state of APT/dpkg: modification times and sizes of the dpkg status file and
+# the package lists, the current kernel and the architecture. If any of these changes, the list of kernels changes.
+def get_apt_fingerprint():
+    global debugmode
+
+    fingerprint = hashlib.sha1()
+    fingerprint.update(("%s %s\n" % (get_current_kernel(), platformis64bit)).encode("utf-8"))
+
+    try:
+        files = [os.stat("/var/lib/dpkg/status")]
+        files[0] = ("status", files[0].st_mtime_ns, files[0].st_size)
+
+        if os.path.isdir("/var/lib/apt/lists"):
+            for entry in os.scandir("/var/lib/apt/lists"):
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append((entry.name, stat.st_mtime_ns, stat.st_size))
+
+        for file in sorted(files):
+            fingerprint.update(("%s %d %d\n" % file).encode("utf-8"))
+
+    except Exception as e:
+        if debugmode:
+            print (e)
+
+        # Something is wrong, so don't ever match anything
+        return ""
+
+    return fingerprint.hexdigest()
+
+# Loads the kernel list from the snapshot; returns None if there is no snapshot or it does not match the fingerprint
+def load_kernel_snapshot(fingerprint):
+    global debugmode
+
+    if len(fingerprint) == 0 or not os.path.isfile(kernel_snapshot_file):
+        return None
+
+    try:
+        with open(kernel_snapshot_file, "r") as f:
+            snapshot = json.load(f)
+
+        if snapshot.get('format', 1) != kernel_snapshot_format or snapshot['fingerprint'] != fingerprint:
+            return None
+
+        return [KernelRecord.from_dict(kernel) for kernel in snapshot['kernels']]
+
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return None
+
+# Saves the kernel list as snapshot together with the fingerprint of the state of APT/dpkg
+def save_kernel_snapshot(fingerprint, kernels):
+    global debugmode
+
+    if len(fingerprint) == 0:
+        return
+
+    try:
+        os.makedirs(os.path.dirname(kernel_snapshot_file), exist_ok=True)
+
+        with tempfile.NamedTemporaryFile("w", dir = os.path.dirname(kernel_snapshot_file), delete = False) as f:
+            json.dump({'format': kernel_snapshot_format, 'fingerprint': fingerprint, 'kernels': [kernel.to_dict() for kernel in kernels]}, f)
+
+        os.replace(f.name, kernel_snapshot_file)
+
+    except Exception as e:
+        if debugmode:
+            print (e)
 
 # Returns the current kernel as string in the format "4.10.0-28-generic"; "unknown" is returned if an exception occurred
 def get_current_kernel():
-    global debugmode
+    global debugmode, current_kernel
+
+    # The running kernel does not change while kittykernel is running
+    if current_kernel is not None:
+        return current_kernel
+
     try:
-        # call uname to get the current kernel; truncate a little bit
-        return subprocess.check_output("uname -r", shell = True).decode("utf-8").strip()
+        # Same as 'uname -r'
+        current_kernel = os.uname().release.strip()
+        return current_kernel
     except Exception as e:
         if debugmode:
             print (e)
@@ -208,12 +497,87 @@ def strip_kernel_version(version, maxsubversion = 10):
     return ".".join(intversions)
 
 
-# Downloads and returns a list of kernels; an empty string is returned if an exception occurred
-def get_kernels():
-    global cache, debugmode, platformis64bit
+# Kernel image packages (versions 1 to 5); used to find the kernels in the package names of the cache
+kernel_image_pattern = re.compile(u"linux-image-[1-5]")
+
+# Creates the kernel record for a package of the cache; returns None if the package is not a kernel image
+# of the right architecture. 'current_version' is the current kernel (see get_current_kernel).
+def get_kernel_info(pkg, current_version):
+    global debugmode, platformis64bit
+
+    # Kernel package? Check for versions 1 to 5 here
+    if not kernel_image_pattern.match(pkg.name):
+        return None
+
+    # Pkg is 64bit?
+    pkgis64bit = (pkg.architecture() == "amd64")
+
+    # If the package has not the right architecture... we will just go on
+    if pkgis64bit != platformis64bit:
+        return None
+
+    # Create an empty kernel record
+    kernel = KernelRecord(package = pkg.name, fullname = pkg.fullname)
+    origins = []
+
+    # Print name and version in debug mode
+    if debugmode:
+        print(kernel.package, strip_kernel_version(kernel.package), pkg.architecture() )
+
+    # Save full version and major version of package
+    kernel.version = strip_kernel_version(kernel.package)
+    if len(kernel.version.split('.')) > 2:
+        kernel.version_major = kernel.version.split('.')[0] + "." + kernel.version.split('.')[1]
+    else:
+        # This is probably a generic image; ignore it for now
+        return None
+
+    # Get all the flags
+    kernel.active = (kernel.package.replace("linux-image-", "") == current_version)
+    kernel.installed = pkg.is_installed
+    kernel.downloaded = pkg.has_config_files
+
+    # Package version is either the version installed or the candidate version; no pkg_version means = not available
+    if kernel.installed:
+        kernel.pkg_version = pkg.installed.version                    
+    elif pkg.candidate and pkg.candidate.downloadable:
+        kernel.pkg_version = pkg.candidate.version
+
+    # Sizes of package
+    if pkg.candidate:
+        kernel.size = pkg.candidate.size
+        kernel.installed_size = pkg.candidate.installed_size
+
+    # Copy the origins
+    for origin in pkg.candidate.origins:
+        # Ignore "now" archives
+        if origin.archive != "now":
+            origins.append("%s (%s, %s, %s)" % (origin.label, origin.archive, origin.site, [_("trusted") if origin.trusted else _("not trusted")][0]) )
+
+    # Join in single string
+    kernel.origins = ", ".join(origins)
+
+    return kernel
+
+# Downloads and returns a list of kernels; an empty string is returned if an exception occurred. The list is taken
+# from the snapshot if the state of APT/dpkg did not change since it was created (unless 'use_snapshot' is False).
+def get_kernels(use_snapshot = True):
+    global debugmode, platformis64bit
     try:
+        # Anything changed since last time?
+        fingerprint = get_apt_fingerprint()
+
+        if use_snapshot:
+            kernel_list = load_kernel_snapshot(fingerprint)
+
+            if kernel_list is not None:
+                if debugmode:
+                    print("Using kernel snapshot.")
+                return kernel_list
+
         # First, get the current version
         current_version = get_current_kernel()        
+        cache = get_cache()
 
         # DEBUG only
         if debugmode:
@@ -222,65 +586,59 @@ def get_kernels():
         # Create empty list to return
         kernel_list = []
 
-        # Check the packages in the cache
-        for pkg in cache:
-            # Pkg is 64bit?
-            pkgis64bit = (pkg.architecture() == "amd64")
-
-            # If the package has not the right architecture... we will just go on
-            if pkgis64bit != platformis64bit:
+        # Check the packages in the cache; only the names are checked first (this is much faster than creating
+        # package objects for all the packages in the cache), package objects are only created for kernels
+        for name in cache.keys():
+            if not kernel_image_pattern.match(name):
                 continue
 
-            # Create an empty dictionary object
-            kernel = { 'version_major': '', 'version': '', 'package': pkg.name, 'pkg_version': '',
-                       'size': 0, 'installed_size': 0, 'origins': [], 'fullname': pkg.fullname,
-                       'active': False, 'installed': False, 'downloaded': False }
+            kernel = get_kernel_info(cache[name], current_version)
 
-            # Kernel package? Check for versions 1 to 5 (the 6 is exclusive!) here
-            if kernel['package'].startswith( tuple(["linux-image-"+str(x) for x in range(1,6)]) ):
+            # Add kernel record to list
+            if kernel is not None:
+                kernel_list.append(kernel)
 
-                # Print name and version in debug mode
-                if debugmode:
-                    print(kernel['package'], strip_kernel_version(kernel['package']), pkg.architecture() )
+        # Sort list by version, save snapshot, and return it
+        kernel_list = sorted(kernel_list, key=lambda item: parse_version(item.version), reverse=True) 
 
-                # Save full version and major version of package
-                kernel['version'] = strip_kernel_version(kernel['package'])
-                if len(kernel['version'].split('.')) > 2:
-                    kernel['version_major'] = kernel['version'].split('.')[0] + "." + kernel['version'].split('.')[1]
-                else:
-                    # This is probably a generic image; ignore it for now
-                    continue
+        save_kernel_snapshot(fingerprint, kernel_list)
+
+        return kernel_list
 
-                # Get all the flags
-                kernel['active'] = (kernel['package'].replace("linux-image-", "") == current_version)
-                kernel['installed'] = pkg.is_installed
-                kernel['downloaded'] = pkg.has_config_files
+    # If something is wrong, return an empty list
+    except Exception as e:
+        if debugmode:
+            print (e)
+            print(sys.exc_info())
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            print(exc_type, fname, exc_tb.tb_lineno)
+        return []
 
-                # Package version is either the version installed or the candidate version; no pkg_version means = not available
-                if kernel['installed']:
-                    kernel['pkg_version'] = pkg.installed.version                    
-                elif pkg.candidate and pkg.candidate.downloadable:
-                    kernel['pkg_version'] = pkg.candidate.version
+# Rereads the kernels with the given package names from the cache (e.g. after installing or removing them) and
+# updates them in the list 'kernels' in place; returns the indices of the kernels, which were updated
+def update_kernels(kernels, packages):
+    global debugmode
+    try:
+        # The state of the packages changed, so the cache has to be reread
+        reopen_cache()
 
-                # Sizes of package
-                if pkg.candidate:
-                    kernel['size'] = pkg.candidate.size
-                    kernel['installed_size'] = pkg.candidate.installed_size
+        cache = get_cache()
+        current_version = get_current_kernel()
 
-                # Copy the origins
-                for origin in pkg.candidate.origins:
-                    # Ignore "now" archives
-                    if origin.archive != "now":
-                        kernel['origins'].append("%s (%s, %s, %s)" % (origin.label, origin.archive, origin.site, [_("trusted") if origin.trusted else _("not trusted")][0]) )
+        updated = []
 
-                # Join in single string
-                kernel['origins'] = ", ".join(kernel['origins'])
+        for index, kernel in enumerate(kernels):
+            if kernel.package not in packages or kernel.fullname not in cache:
+                continue
 
-                # Add kernel dictionary to list
-                kernel_list.append(kernel)
+            kernel = get_kernel_info(cache[kernel.fullname], current_version)
 
-        # Sort list by version and return it
-        return sorted(kernel_list, key=lambda item: list(map(str, item['version'].replace('-', '.').split('.'))), reverse=True) 
+            if kernel is not None:
+                kernels[index] = kernel
+                updated.append(index)
+
+        return updated
 
     # If something is wrong, return an empty list
     except Exception as e:
@@ -292,66 +650,356 @@ def get_kernels():
             print(exc_type, fname, exc_tb.tb_lineno)
         return []
 
-# Gets the kernel changelogs for all major versions
-def get_kernel_changelogs(kernels):
-    # Changelog path
-    changelog_path = os.path.expanduser("~/.config/kittykernel/changelogs")
+# Header line of a version in a changelog, e.g. "linux (4.15.0-29.31) bionic; urgency=medium"
+changelog_header_pattern = re.compile(u"^\\S+ \\(([^()\\s]+)\\)", re.MULTILINE)
+
+# First line of logs of older versions of kittykernel: just the version of the kernel
+changelog_legacy_version_pattern = re.compile(u"^[0-9][0-9A-Za-z.+~:-]*$")
+
+# Returns the sections of a changelog, i.e. a list of [version, character offset, byte offset (UTF-8)] for each
+# version header in the order of the log; the offsets point to the opening bracket before the version
+def get_changelog_sections(log):
+    sections = []
+    last_offset = 0
+    byte_offset = 0
+
+    for match in changelog_header_pattern.finditer(log):
+        offset = match.start(1) - 1
+
+        # Only encode the text since the last header, so the whole log is encoded once
+        byte_offset += len(log[last_offset:offset].encode("utf-8"))
+        last_offset = offset
+
+        sections.append([match.group(1), offset, byte_offset])
+
+    return sections
+
+# Store of the kernel changelogs, one per major version; the logs are saved as <major>.log in the changelog path
+# and index.json says which kernel version each log belongs to. Logs are only read from disk (via mmap) when
+# they are needed, e.g. 'major in store' and 'store[major]' work like a dictionary. For each log, the offsets
+# of its version headers are saved as <major>.idx (see get_changelog_sections), so a version can be found without
+# searching the log.
+class ChangelogStore():
+    path = ""
+    index = {}
+    _sections = {}
+    _versions = {}
+    _lock = None
+
+    def __init__(self, path = None):
+        self.path = [os.path.expanduser("~/.config/kittykernel/changelogs") if path is None else path][0]
+        self.index = {}
+        self._sections = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+        # Create directory if it does not exist, yet
+        os.makedirs(self.path, exist_ok=True)
+
+        self.load_index()
+
+    # Log file of a major version
+    def get_logfile(self, major):
+        return self.path + '/' + major + '.log'
+
+    # Section index file of a major version
+    def get_sectionfile(self, major):
+        return self.path + '/' + major + '.idx'
+
+    # Loads the index from file; logs of older versions of kittykernel, which have the version in the first
+    # line instead of the index, are converted. Other logs, which are not in the index (e.g. the update was
+    # interrupted), are removed, so they are downloaded again.
+    def load_index(self):
+        global debugmode
+
+        try:
+            with open(self.path + '/index.json', "r") as f:
+                self.index = json.load(f)
+        except Exception as e:
+            if debugmode and os.path.isfile(self.path + '/index.json'):
+                print (e)
+            self.index = {}
+
+        for filename in os.listdir(self.path):
+            major = filename[:-len('.log')]
+            if not filename.endswith('.log') or major in self.index:
+                continue
 
-    # Create directory if it does not exist, yet
-    os.makedirs(changelog_path, exist_ok=True)
+            try:
+                with open(self.get_logfile(major), "r", encoding = "utf-8", errors = "replace") as f:
+                    version = f.readline().strip()
+                    log = f.read()
 
-    # Create changelog dictionary: key should be major version and 
-    changelogs = {}
+                if changelog_legacy_version_pattern.match(version):
+                    self.write_log(major, version, log)
+                else:
+                    self.remove_log(major)
 
-    # Check each kernel
-    for kernel in kernels:
-        # Already in list
-        if kernel['version_major'] in changelogs:
-            continue
+            except Exception as e:
+                if debugmode:
+                    print (e)
 
-        # Log file name
-        logfile = changelog_path + '/' + kernel['version_major'] + '.log'
+        self.save_index()
 
-        # Already on file?
-        if os.path.isfile(logfile):
-            # Open file and read first line
-            with open(logfile, "r") as f:
-                version_on_file = f.readline()
+    # Saves the index to file; under the lock, so several threads saving the index cannot overtake each other
+    def save_index(self):
+        with self._lock:
+            with tempfile.NamedTemporaryFile(mode = "w", dir = self.path, prefix = "tmp", delete = False) as f:
+                json.dump(self.index, f)
 
-            # If version on file is latest (or even newer for some reason), then 
-            # use simply this file and continue
-            if compare_versions(kernel['version'], version_on_file) != 1:
-                # Open file and read all lines
-                with open(logfile, "r") as f:
-                    log = f.readlines()
+            os.replace(f.name, self.path + '/index.json')
 
-                # Remove first line
-                del log[0]
+    # Writes the log of a major version and adds it to the index, which is saved right away; a log on disk
+    # is therefore never missing from the saved index (except if kittykernel is stopped in between, see load_index)
+    def write_log(self, major, version, log):
+        # Always UTF-8 (whatever the locale is); logs are decoded and section offsets are counted in UTF-8
+        with tempfile.NamedTemporaryFile(mode = "w", encoding = "utf-8", dir = self.path, prefix = "tmp", delete = False) as f:
+            f.write(log)
 
-                # Join lines and add to changelogs; then continue
-                changelogs[kernel['version_major']] = ''.join(log)
-                continue
+        os.replace(f.name, self.get_logfile(major))
 
-        # Download changelog: since the list is sorted from latest to oldest versions, we do
-        # not need to make additional checks: the first item for each major version is always
-        # the latest
-        log = get_kernel_changelog(kernel['fullname'])
+        self.write_sections(major, get_changelog_sections(log))
 
-        # Write to file
-        with open(logfile, "w") as f:
-            f.write(kernel['version'] + '\n')
-            f.write(log)
+        with self._lock:
+            self.index[major] = version
+
+        self.save_index()
+
+    # Writes the section index of a major version
+    def write_sections(self, major, sections):
+        with tempfile.NamedTemporaryFile(mode = "w", dir = self.path, prefix = "tmp", delete = False) as f:
+            json.dump(sections, f)
+
+        os.replace(f.name, self.get_sectionfile(major))
+
+        with self._lock:
+            self._sections[major] = sections
+            self._versions.pop(major, None)
+
+    # Removes the log of a major version (but does not save the index)
+    def remove_log(self, major):
+        with self._lock:
+            self.index.pop(major, None)
+            self._sections.pop(major, None)
+            self._versions.pop(major, None)
+
+        for filename in [self.get_logfile(major), self.get_sectionfile(major)]:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+    # Brings the store up to date with a kernel list: logs, which are missing or older than the latest kernel of
+    # their major version, are downloaded by 'workers' threads at the same time; logs of major versions, which
+    # are not in the list anymore, are removed
+    def update(self, kernels, workers = None):
+        global debugmode
+
+        # The list is sorted from latest to oldest versions, so the first kernel of each major version is always
+        # the latest one
+        latest = collections.OrderedDict()
+        for kernel in kernels:
+            if kernel.version_major not in latest:
+                latest[kernel.version_major] = kernel
+
+        for major in list(self.index.keys()):
+            if major not in latest:
+                self.remove_log(major)
+
+        missing = [kernel for major, kernel in latest.items() if major not in self or compare_versions(kernel.version, self.index[major]) == 1]
+
+        # The urls are looked up first, since the package records of the cache must not be used by several
+        # threads at the same time
+        urls = [get_kernel_changelog_url(kernel.fullname) for kernel in missing]
+
+        # Downloads a single log; returns True if it worked. Logs, which could not be downloaded, are not saved,
+        # so they are tried again with the next update
+        def download(kernel, url):
+            try:
+                with urllib.request.urlopen(url) as urlfile:
+                    log = urlfile.read().decode("utf-8", "replace")
+            except Exception as e:
+                if debugmode:
+                    print("Changelog %s: %s" % (url, e))
+                return False
+
+            if len(log) > 0:
+                self.write_log(kernel.version_major, kernel.version, log)
+
+            return len(log) > 0
+
+        results = []
+        if len(missing) > 0:
+            if workers is None:
+                workers = changelog_workers
 
-        # Append to list
-        changelogs[kernel['version_major']] = log
+            with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+                results = list(executor.map(download, missing, urls))
+
+        # Logs without a (working) url are loaded the way APT does it, one after the other
+        for kernel, result in zip(missing, results):
+            if not result:
+                log = get_kernel_changelog(kernel.fullname)
+                if len(log) > 0:
+                    self.write_log(kernel.version_major, kernel.version, log)
+
+        self.save_index()
+
+        if debugmode:
+            print("Changelogs downloaded: ", [kernel.version_major for kernel in missing])
+
+    def __contains__(self, major):
+        with self._lock:
+            return major in self.index
+
+    def __len__(self):
+        with self._lock:
+            return len(self.index)
+
+    # Reads the log of a major version from disk; raises KeyError if there is none
+    def __getitem__(self, major):
+        if major not in self:
+            raise KeyError(major)
+
+        with open(self.get_logfile(major), "rb") as f:
+            # Empty files cannot be mapped
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""
+
+            with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as data:
+                return data[:].decode("utf-8", "replace")
+
+    # Reads the sections 'first' to 'last' (excluding 'last') of the log of a major version from disk (see
+    # get_sections); each section starts at the beginning of the line of its header, the first section
+    # includes everything before it and the last section everything until the end of the log. Hence, reading
+    # all sections from 0 on in pieces gives the whole log.
+    def read_sections(self, major, first, last):
+        sections = self.get_sections(major)
+
+        if len(sections) == 0 or first >= last:
+            return ""
+
+        with open(self.get_logfile(major), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as data:
+                # Beginning of the line of a section; end of the log for the last section
+                def get_line_start(index):
+                    if index == 0:
+                        return 0
+                    if index >= len(sections):
+                        return len(data)
+                    return data.rfind(b'\n', 0, sections[index][2]) + 1
+
+                return data[get_line_start(first):get_line_start(last)].decode("utf-8", "replace")
+
+    # Returns the sections of the log of a major version (see get_changelog_sections); the section index is
+    # created if it is missing (e.g. for logs of older versions of kittykernel). Empty list if there is no log.
+    def get_sections(self, major):
+        global debugmode
+
+        if major not in self:
+            return []
+
+        with self._lock:
+            if major in self._sections:
+                return self._sections[major]
+
+        try:
+            if os.path.getmtime(self.get_sectionfile(major)) >= os.path.getmtime(self.get_logfile(major)):
+                with open(self.get_sectionfile(major), "r") as f:
+                    sections = json.load(f)
+
+                with self._lock:
+                    self._sections[major] = sections
+
+                return sections
+
+        except Exception as e:
+            if debugmode and os.path.isfile(self.get_sectionfile(major)):
+                print (e)
+
+        sections = get_changelog_sections(self[major])
+        self.write_sections(major, sections)
+
+        return sections
+
+    # Finds the section of a kernel in the log of its major version; returns [version, character offset,
+    # byte offset] or None. Parts of the package version separated by ~ are removed until a section is
+    # found, i.e. it will look for "4.10.0-28.32~16.04.2", then for "4.10.0-28.32", and then for the
+    # first section starting with "4.10".
+    def find_section(self, major, pkg_version):
+        sections = self.get_sections(major)
+
+        # Versions to look for; exact matches first
+        searchlist = pkg_version.split('~')
+        searchlist = ["~".join(searchlist[:len(searchlist)-n]) for n in range(len(searchlist))] + [major]
+
+        # Dictionary of versions and their (first) section
+        with self._lock:
+            if major not in self._versions:
+                self._versions[major] = {}
+                for section in sections:
+                    self._versions[major].setdefault(section[0], section)
+
+            versions = self._versions[major]
+
+        for searchstr in searchlist:
+            if searchstr in versions:
+                return versions[searchstr]
+
+        # Nothing found; the sections, which start with the version, are the next best thing
+        for searchstr in searchlist:
+            for section in sections:
+                if section[0].startswith(searchstr):
+                    return section
+
+        return None
+
+# Gets the kernel changelogs for all major versions; returns a ChangelogStore
+def get_kernel_changelogs(kernels, workers = None):
+    changelogs = ChangelogStore()
+    changelogs.update(kernels, workers)
 
     # Return all the beautiful changelogs!
     return changelogs
 
+# Gets the url of the changelog of a package the same way APT does it (see apt.Package.get_changelog); the url
+# is an empty string if the package is not in the cache or something went wrong
+def get_kernel_changelog_url(fullname):
+    global debugmode
+
+    try:
+        cache = get_cache()
+
+        if fullname not in cache or cache[fullname].candidate is None:
+            return ""
+
+        candidate = cache[fullname].candidate
+
+        # Source package and version without epoch
+        src_pkg = candidate.source_name
+        src_ver = re.sub(u"^[0-9]+:", "", candidate.source_version)
+
+        # Section is 'main' unless the package says otherwise (e.g. 'universe/kernel')
+        src_section = ["main" if candidate.section.find('/') == -1 else candidate.section.split('/')[0]][0]
+
+        # Pool prefix: first letter or 'libX'
+        prefix = [src_pkg[:4] if src_pkg.startswith("lib") else src_pkg[0]][0]
+
+        if candidate.origins[0].origin == "Debian":
+            uri = "http://packages.debian.org/changelogs/pool/%s/%s/%s/%s_%s/changelog"
+        else:
+            uri = "http://changelogs.ubuntu.com/changelogs/pool/%s/%s/%s/%s_%s/changelog"
+
+        return uri % (src_section, prefix, src_pkg, src_pkg, src_ver)
+
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return ""
+
 # Gets the kernel changelog as unicode string; string is empty, if something went wrong
 def get_kernel_changelog(fullname):
-    global cache
     try:
+        cache = get_cache()
+
         # Is package in cache? Then, try to retrieve and return changelog
         if fullname in cache:
             return cache[fullname].get_changelog()
@@ -398,10 +1046,99 @@ def get_kernel_support_times():
     return supportlist
 
 
-# Invokes synaptic with pkexec to do something with packages; operations is a list of tuples such as
-# ('install', pkg1), ('remove', pkg2), or ('purge', pkg3); this function does not check for additional
-# packages to be installed or removed (just the dependencies)
-def pkg_perform_operations(operations, xwindow_id = 0):
+# Groups a list of kernels by major version in a single pass; returns a list of groups (latest version first). Each
+# group is a dictionary with 'version_major', the number of 'available', 'downloaded', and 'installed' kernels,
+# 'active' (True if the active kernel is in this group), and 'support' (entry of the support times or None).
+# The support times are matched with the origins of the first kernel of each group.
+def get_kernel_groups(kernels, support_times):
+    groups = collections.OrderedDict()
+
+    for kernel in kernels:
+        group = groups.get(kernel.version_major)
+
+        if group is None:
+            group = {'version_major': kernel.version_major, 'available': 0, 'downloaded': 0, 'installed': 0, 'active': False,
+                     'support': None, 'origins': kernel.origins}
+            groups[kernel.version_major] = group
+
+        group['available'] += 1
+        group['downloaded'] += int(bool(kernel.downloaded))
+        group['installed'] += int(bool(kernel.installed))
+        group['active'] = group['active'] or kernel.active
+
+    # Support times by version, so each group needs to check only its own entries; the last matching entry wins
+    support_versions = {}
+    for entry in support_times:
+        support_versions.setdefault(entry['version'], []).append(entry)
+
+    for group in groups.values():
+        for entry in support_versions.get(group['version_major'], []):
+            if group['origins'].find(entry['origin']+' ') != -1:
+                group['support'] = entry
+
+    # Latest version first
+    return sorted(groups.values(), key = lambda group: parse_version(group['version_major']), reverse = True)
+
+# Returns the backend for changing packages (see package_backends); 'backend' overrides the config, None or 'auto'
+# choose the backend automatically
+def get_package_backend(backend = None):
+    global debugmode
+
+    if backend is None:
+        try:
+            backend = load_config()['Packages']['backend']
+        except Exception as e:
+            if debugmode:
+                print (e)
+            backend = 'auto'
+
+    if backend not in package_backends or backend == 'auto':
+        backend = ['apt' if os.getuid() == 0 else 'apt-get'][0]
+
+    return backend
+
+# Returns a command, which runs with root rights (via pkexec if kittykernel is not run as root); dpkg should not
+# ask any questions, since nobody would see them
+def get_privileged_command(cmd):
+    return [[] if os.getuid() == 0 else ["pkexec"]][0] + ["env", "DEBIAN_FRONTEND=noninteractive"] + cmd
+
+# Passes the download progress of python-apt on to a function, which is called with (fraction, text)
+class AptAcquireProgress(apt.progress.base.AcquireProgress):
+    def __init__(self, progress):
+        apt.progress.base.AcquireProgress.__init__(self)
+        self._progress = progress
+
+    def pulse(self, owner):
+        apt.progress.base.AcquireProgress.pulse(self, owner)
+
+        if self._progress is not None:
+            self._progress(float(self.current_bytes) / float(max(1, self.total_bytes)), _("Downloading packages..."))
+
+        return True
+
+# Passes the installation progress of python-apt (dpkg) on to a function, which is called with (fraction, text)
+class AptInstallProgress(apt.progress.base.InstallProgress):
+    def __init__(self, progress, errors = None):
+        apt.progress.base.InstallProgress.__init__(self)
+        self._progress = progress
+        self._errors = errors
+
+    def status_change(self, pkg, percent, status):
+        if self._progress is not None:
+            self._progress(percent / 100.0, status)
+
+    def error(self, pkg, errormsg):
+        if self._errors is not None:
+            self._errors.append("%s: %s" % (pkg, errormsg))
+
+# Does something with packages; operations is a list of tuples such as ('install', pkg1), ('remove', pkg2), or
+# ('purge', pkg3); this function does not check for additional packages to be installed or removed (just the
+# dependencies). All operations are done in one transaction by the backend given (see get_package_backend).
+# 'progress' can be a function, which is called with (fraction, text) while the packages are downloaded and
+# installed (not for synaptic, which shows its own progress). If 'errors' is a list, the error messages of dpkg are
+# added to it (not for synaptic either). Returns 0 if everything went fine and an error code otherwise: -1/-2 for
+# wrong arguments, -3 for exceptions, -4 if root is needed, and the exit code of apt-get.
+def pkg_perform_operations(operations, xwindow_id = 0, backend = None, progress = None, errors = None):
     global debugmode
 
     if debugmode:
@@ -410,20 +1147,36 @@ def pkg_perform_operations(operations, xwindow_id = 0):
     if type(operations) is not list:
         return -1
 
-    if type(operations[0]) is not tuple:
+    if len(operations) == 0 or type(operations[0]) is not tuple:
         return -2
 
+    # Only these operations are allowed
+    operations = [op for op in operations if op[0] in ['install', 'remove', 'purge']]
+
+    backend = get_package_backend(backend)
+
+    if backend == 'synaptic':
+        result = pkg_perform_operations_synaptic(operations, xwindow_id)
+    elif backend == 'apt':
+        result = pkg_perform_operations_apt(operations, progress, errors)
+    else:
+        result = pkg_perform_operations_apt_get(operations, progress, errors)
+
+    # Kernels were installed or removed, so /boot has another size now
+    invalidate_sizeof_boot()
+
+    return result
+
+# Invokes synaptic with pkexec to do something with packages (see pkg_perform_operations)
+def pkg_perform_operations_synaptic(operations, xwindow_id = 0):
+    global debugmode
+
     try:
         # Write the list of packages in a temp file            
         f = tempfile.NamedTemporaryFile()
 
         # Create entry for each operation
         for op in operations:
-
-            # Check if operation is allowed
-            if op[0] not in ['install', 'remove', 'purge']:
-                continue
-
             # Write to temp file
             f.write( ("%s\t%s\n" % (op[1], op[0])).encode("utf-8") )
 
@@ -441,69 +1194,552 @@ def pkg_perform_operations(operations, xwindow_id = 0):
 
         out = subprocess.Popen(' '.join(cmd), shell=True)
 
-        # get output
-        stdout, stderr = out.communicate()
+        # Wait until synaptic is finished
+        out.communicate()
 
+        return 0
+
+    # If something is wrong, return error code
+    except Exception as e:
         if debugmode:
-        	print(stdout.read())
-        	print(stderr.read())
+            print (e)
+            print(sys.exc_info())
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            print(exc_type, fname, exc_tb.tb_lineno)
+        return -3
+
+# Marks the packages in the APT cache and commits the changes (see pkg_perform_operations); needs root
+def pkg_perform_operations_apt(operations, progress = None, errors = None):
+    global debugmode
+
+    if os.getuid() != 0:
+        return -4
+
+    cache = get_cache()
+
+    try:
+        # Mark all packages at once; the dependencies are resolved at the end of the action group
+        with cache.actiongroup():
+            for op in operations:
+                if op[1] not in cache:
+                    continue
+
+                if op[0] == 'install':
+                    cache[op[1]].mark_install()
+                else:
+                    cache[op[1]].mark_delete(purge = (op[0] == 'purge'))
+
+        if debugmode:
+            print("Changes: ", [pkg.name for pkg in cache.get_changes()])
+
+        cache.commit(AptAcquireProgress(progress), AptInstallProgress(progress, errors))
 
         return 0
-        
 
     # If something is wrong, return error code
     except Exception as e:
+        if errors is not None:
+            errors.append(str(e))
         if debugmode:
             print (e)
             print(sys.exc_info())
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             print(exc_type, fname, exc_tb.tb_lineno)
+        cache.clear()
         return -3
 
+    finally:
+        # The state of the packages changed
+        reopen_cache(force = True)
+
+# Runs apt-get (with pkexec if necessary) to do something with packages (see pkg_perform_operations); the progress is
+# read from the status messages of apt-get (APT::Status-Fd). apt-get is never left running on its own: whatever
+# happens while reading its messages, kittykernel waits until it is finished and returns its exit code.
+def pkg_perform_operations_apt_get(operations, progress = None, errors = None):
+    global debugmode
+
+    # Suffixes of the packages for apt-get install: + to install, - to remove, _ to purge
+    suffixes = {'install': '+', 'remove': '-', 'purge': '_'}
+
+    cmd = get_privileged_command(["apt-get", "-y", "-q", "-o", "APT::Status-Fd=1", 
+                                  "-o", "Dpkg::Options::=--force-confdef", "-o", "Dpkg::Options::=--force-confold", "install"] + 
+                                  [op[1] + suffixes[op[0]] for op in operations])
+
+    process = None
+    try:
+        process = subprocess.Popen(cmd, stdout = subprocess.PIPE, universal_newlines = True)
+
+        # Status lines look like "dlstatus:1:20.5:Downloading ...", "pmstatus:linux-image-...:45.2:Installing ...",
+        # or "pmerror:linux-image-...:45.2:subprocess ... returned error exit status 1"; lines, which cannot be
+        # understood, are skipped
+        for line in process.stdout:
+            columns = line.strip().split(':', 3)
+
+            try:
+                if len(columns) == 4 and columns[0] == 'pmerror':
+                    if errors is not None:
+                        errors.append("%s: %s" % (columns[1], columns[3]))
+                    if debugmode:
+                        print(line.rstrip())
+
+                elif len(columns) == 4 and columns[0] in ['dlstatus', 'pmstatus']:
+                    if progress is not None:
+                        progress(float(columns[2]) / 100.0, [_("Downloading packages...") if columns[0] == 'dlstatus' else columns[3]][0])
+
+                elif debugmode:
+                    print(line.rstrip())
+
+            except Exception as e:
+                if debugmode:
+                    print("Status line %s: %s" % (line.rstrip(), e))
+
+    # If something is wrong, return error code (but only if apt-get is not running)
+    except Exception as e:
+        if debugmode:
+            print (e)
+            print(sys.exc_info())
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            print(exc_type, fname, exc_tb.tb_lineno)
+
+        if process is None:
+            return -3
+
+    # Read the rest of the messages (so apt-get does not block on a full pipe) and wait until it is finished
+    process.communicate()
+
+    return process.returncode
+
+
+# Returns the operations for installing/removing/purging a list of kernels with extra package (if available) and
+# headers, i.e. a list of tuples such as ('install', pkg1) (see pkg_perform_operations)
+def get_kernel_operations(fullnames, verb, headers = True, extras = True):
+    cache = get_cache()
+
+    # Our operation list
+    operations = []
+
+    # For each package name check if headers and extras are available and add to list
+    for pkg in fullnames:
+
+        # Is package in cache? Then add it
+        if pkg in cache:
+            # Create list of packages to install including headers, modules, extras
+            pkg_list = [cache[pkg].name, cache[pkg].name.replace("-image-", "-modules-")]
+
+            if headers:
+                pkg_list.append(cache[pkg].name.replace("-image-", "-headers-"))
+
+            if extras:
+                pkg_list.append(cache[pkg].name.replace("-image-", "-image-extra-"))
+                pkg_list.append(cache[pkg].name.replace("-image-", "-modules-extra-"))
+
+            # Add to operations
+            for entry in pkg_list:
+                if entry in cache:
+                    operations.append( (verb, entry) )
+
+    return operations
+
+# Installs/Removes/Purges a list of kernels with extra package (if available) and headers
+def perform_kernels(fullnames, verb, xwindow_id = 0, headers = True, extras = True, backend = None, progress = None, errors = None):
+    global debugmode
+    try:
+        if debugmode:        
+            print("Perform_kernels:", fullnames, verb)
+
+        # Perform actions
+        return pkg_perform_operations(get_kernel_operations(fullnames, verb, headers, extras), xwindow_id, backend, progress, errors)         
+
+    # If something is wrong, return an empty list
+    except Exception as e:
+        if debugmode:
+            print (e)
+            print(sys.exc_info())
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            print(exc_type, fname, exc_tb.tb_lineno)
+        return -1
+
+# Returns the number of bytes the files in /boot occupy per kernel release (e.g. "4.15.0-29-generic") as dictionary;
+# files of a release are vmlinuz-<release>, initrd.img-<release>, System.map-<release>, config-<release>, etc.
+def get_boot_usages(boot_path = "/boot"):
+    global debugmode
+
+    usages = {}
+
+    try:
+        for entry in os.scandir(boot_path):
+            match = boot_file_pattern.match(entry.name)
+
+            if match and entry.is_file(follow_symlinks = False):
+                usages[match.group(1)] = usages.get(match.group(1), 0) + entry.stat(follow_symlinks = False).st_size
+
+    except OSError as e:
+        if debugmode:
+            print (e)
+
+    return usages
+
+# Returns the release of a kernel package, e.g. "4.15.0-29-generic" for "linux-image-4.15.0-29-generic"; an empty
+# string if the package is no kernel image
+def get_kernel_release(package):
+    match = re.match(u"^linux-image-(?:unsigned-)?([0-9].*)$", package.split(':')[0])
+
+    return [match.group(1) if match else ""][0]
+
+# Plans operations (see pkg_perform_operations) without doing anything: the packages are marked in the APT cache,
+# all dependencies are resolved, and then the marks are removed again. Returns a dictionary with
+#   'install'/'remove':    names of all packages to install/remove (including dependencies)
+#   'extra_remove':        names of packages to remove, which are not in the operations (e.g. packages depending on
+#                          them); the user should be asked about them
+#   'download':            bytes to download
+#   'space':               bytes used (positive) or freed (negative) on the system after the operations
+#   'boot':                bytes used (positive) or freed (negative) on /boot; installed kernels are estimated by the
+#                          kernels already there (initrd images are created during the installation)
+#   'boot_free'/'root_free': free bytes on /boot and / now
+#   'broken':              True if the dependencies cannot be resolved
+#   'fits':                True if the operations can be done (nothing broken and enough space on /boot and /)
+# Returns None if something went wrong.
+def plan_operations(operations):
+    global debugmode
+
+    cache = get_cache()
+
+    try:
+        # Mark all packages at once; the dependencies are resolved at the end of the action group
+        with cache.actiongroup():
+            for op in operations:
+                if op[1] not in cache:
+                    continue
+
+                if op[0] == 'install':
+                    cache[op[1]].mark_install()
+                elif op[0] in ['remove', 'purge']:
+                    cache[op[1]].mark_delete(purge = (op[0] == 'purge'))
+
+        changes = cache.get_changes()
+
+        plan = {'install': [pkg.name for pkg in changes if pkg.marked_install or pkg.marked_upgrade],
+                'remove': [pkg.name for pkg in changes if pkg.marked_delete],
+                'download': cache.required_download,
+                'space': cache.required_space,
+                'broken': cache.broken_count > 0}
+
+        requested = set([op[1] for op in operations])
+        plan['extra_remove'] = [name for name in plan['remove'] if name not in requested]
+
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return None
+
+    finally:
+        # Remove all marks again
+        cache.clear()
+
+    # Kernels in /boot: removed kernels free their files; new kernels need about as much as the others (on average)
+    # or boot_usage_default if there are no others
+    usages = get_boot_usages()
+    usage_new = [sum(usages.values()) // len(usages) if len(usages) > 0 else boot_usage_default][0]
+
+    plan['boot'] = sum([usage_new for name in plan['install'] if len(get_kernel_release(name)) > 0]) - \
+                   sum([usages.get(get_kernel_release(name), 0) for name in plan['remove'] if len(get_kernel_release(name)) > 0])
+
+    plan['boot_free'] = sizeof_boot()[0]
+
+    try:
+        stats = os.statvfs("/")
+        plan['root_free'] = stats.f_bavail * stats.f_frsize
+    except OSError:
+        plan['root_free'] = 0
+
+    plan['fits'] = not plan['broken'] and plan['boot_free'] - plan['boot'] >= boot_reserve and \
+                   plan['root_free'] - plan['download'] - plan['space'] >= 0
+
+    if debugmode:
+        print("Plan: ", plan)
+
+    return plan
+
+# Returns a short description of a plan (see plan_operations) for showing it to the user
+def get_plan_summary(plan):
+    lines = [_("%d package(s) to install, %d package(s) to remove, %s to download") % (len(plan['install']), len(plan['remove']), sizeof_fmt(plan['download'])),
+             _("/boot: %s %s (%s free), system: %s %s (%s free)") % ([_("needs") if plan['boot'] >= 0 else _("frees")][0], sizeof_fmt(abs(plan['boot'])), sizeof_fmt(plan['boot_free']),
+                                                               [_("needs") if plan['space'] >= 0 else _("frees")][0], sizeof_fmt(abs(plan['space'])), sizeof_fmt(plan['root_free']))]
+
+    if len(plan['extra_remove']) > 0:
+        lines.append(_("Removed as well: %s") % ", ".join(plan['extra_remove']))
+
+    if plan['broken']:
+        lines.append(_("The dependencies of the packages cannot be resolved."))
+    elif not plan['fits']:
+        lines.append(_("There is not enough free space on /boot or the system."))
+
+    return "\n".join(lines)
+
+# Plans installing/removing/purging a list of kernels with extra package (if available) and headers (see plan_operations)
+def plan_kernels(fullnames, verb, headers = True, extras = True):
+    return plan_operations(get_kernel_operations(fullnames, verb, headers, extras))
+
+# Returns the flavour of a kernel package, e.g. "generic" for "linux-image-4.15.0-29-generic"; empty string if the
+# package has no flavour
+def get_kernel_flavour(package):
+    match = re.match(u"^[0-9.]+-[0-9]+-(.+)$", get_kernel_release(package))
+
+    return [match.group(1) if match else ""][0]
+
+# Returns the kernels, which booted fine before (see record_known_good_kernel), as list of releases; oldest first
+def load_known_good_kernels():
+    global debugmode
+
+    try:
+        with open(known_good_file, "r") as f:
+            return [line.strip() for line in f if len(line.strip()) > 0]
+    except Exception as e:
+        if debugmode and os.path.isfile(known_good_file):
+            print (e)
+        return []
+
+# Remembers the running kernel as known-good: it booted and kittykernel runs on it
+def record_known_good_kernel():
+    global debugmode
+
+    current = get_current_kernel()
+    releases = load_known_good_kernels()
+
+    if current == "unknown" or (len(releases) > 0 and releases[-1] == current):
+        return
+
+    releases = [release for release in releases if release != current] + [current]
+
+    try:
+        os.makedirs(os.path.dirname(known_good_file), exist_ok=True)
+
+        with open(known_good_file, "w") as f:
+            f.write("\n".join(releases[-known_good_size:]) + "\n")
+
+    except Exception as e:
+        if debugmode:
+            print (e)
+
+# Returns the retention policy for autoclean from the config as dictionary: 'keep' (number of newest kernels kept
+# per flavour besides the active one) and 'keep_known_good' (keep the last known-good kernel as well)
+def get_autoclean_policy():
+    global debugmode
+
+    try:
+        config = load_config()['Autoclean']
+        return {'keep': max(0, int(config['keep'])), 'keep_known_good': config['keep_known_good'].lower() in ['yes', 'true', '1', 'on']}
+
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return {'keep': int(config_default['Autoclean']['keep']), 'keep_known_good': True}
+
+# Returns the kernels, which should be purged according to a retention policy (see get_autoclean_policy; None means
+# the policy from the config). Kept are the active kernel, all installed kernels newer than the active one (e.g. just
+# installed and not booted yet; they count for 'keep' as well), the 'keep' newest installed kernels of each flavour,
+# and the last known-good kernel other than the active one (if 'keep_known_good'); all other installed kernels and
+# all kernels, which were removed but still have config files, are purged. 'kernels' has to be sorted newest first
+# (as returned by get_kernels).
+def get_autoclean_kernels(kernels, policy = None):
+    if policy is None:
+        policy = get_autoclean_policy()
+
+    # Last known-good kernel, which is not the active one
+    known_good = ""
+    if policy['keep_known_good']:
+        releases = [release for release in load_known_good_kernels() if release != get_current_kernel()]
+        known_good = [releases[-1] if len(releases) > 0 else ""][0]
+
+    kept = {}
+    purge = []
+
+    # Kernels before the active one in the list are newer; if the active kernel is not in the list, none is
+    newer = any([kernel.active for kernel in kernels])
+
+    for kernel in kernels:
+        if kernel.active:
+            newer = False
+
+        if not kernel.installed and not kernel.downloaded:
+            continue
+
+        if kernel.active or (kernel.installed and get_kernel_release(kernel.package) == known_good):
+            continue
+
+        flavour = get_kernel_flavour(kernel.package)
+
+        if kernel.installed and (newer or kept.get(flavour, 0) < policy['keep']):
+            kept[flavour] = kept.get(flavour, 0) + 1
+            continue
+
+        purge.append(kernel)
+
+    return purge
+
+# Returns the file list of dpkg for an installed package (with or without architecture in the name); empty string
+# if there is none
+def get_dpkg_list_file(package):
+    for name in [package, package + ":" + dpkg_architecture]:
+        filename = dpkg_info_path + "/" + name + ".list"
+        if os.path.isfile(filename):
+            return filename
+
+    return ""
+
+# Reads a file list of dpkg; returns the paths (empty list if something went wrong)
+def read_dpkg_list_file(listfile):
+    global debugmode
+
+    try:
+        with open(listfile, "r", encoding = "utf-8", errors = "replace") as f:
+            return [line.rstrip('\n') for line in f if line.startswith('/')]
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return []
+
+# Returns the sizes of files in a directory as dictionary (name => size); only the names given are checked, which
+# are regular files (directories and symlinks do not occupy space on their own)
+def get_directory_file_sizes(directory, names):
+    sizes = {}
+
+    try:
+        for entry in os.scandir(directory):
+            if entry.name in names and entry.is_file(follow_symlinks = False):
+                sizes[entry.name] = entry.stat(follow_symlinks = False).st_size
+    except OSError:
+        pass
+
+    return sizes
+
+# Returns the footprint of packages on disk from the file lists of dpkg plus extra files (e.g. the initrd image,
+# which is created during the installation) as dictionary: 'boot' (bytes in /boot), 'other' (bytes everywhere
+# else), and 'files' (number of files). The files are grouped by directory and every directory is read once; the
+# directories are read by 'workers' threads at the same time (None = footprint_workers).
+def scan_footprint(listfiles, extra_files = [], workers = None):
+    directories = {}
+
+    for filename in [path for listfile in listfiles for path in read_dpkg_list_file(listfile)] + extra_files:
+        directory, name = os.path.split(filename)
+        directories.setdefault(directory, set()).add(name)
+
+    if workers is None:
+        workers = footprint_workers
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+        results = executor.map(lambda directory: (directory, get_directory_file_sizes(directory, directories[directory])), list(directories.keys()))
+
+        footprint = {'boot': 0, 'other': 0, 'files': 0}
+
+        for directory, sizes in results:
+            where = ['boot' if directory == "/boot" or directory.startswith("/boot/") else 'other'][0]
+            footprint[where] += sum(sizes.values())
+            footprint['files'] += len(sizes)
+
+    return footprint
+
+# Loads the footprint cache from file
+def load_footprint_cache():
+    global footprint_cache, debugmode
+
+    footprint_cache = {}
+
+    try:
+        if os.path.isfile(footprint_cache_file):
+            with open(footprint_cache_file, "r") as f:
+                footprint_cache = json.load(f)
+    except Exception as e:
+        if debugmode:
+            print (e)
+        footprint_cache = {}
+
+# Saves the footprint cache to file
+def save_footprint_cache():
+    global debugmode
+
+    try:
+        with footprint_cache_lock:
+            data = json.dumps(footprint_cache)
+
+        os.makedirs(os.path.dirname(footprint_cache_file), exist_ok=True)
+
+        # Write to a temporary file first, so the cache is never left half-written
+        with tempfile.NamedTemporaryFile("w", dir = os.path.dirname(footprint_cache_file), delete = False) as f:
+            f.write(data)
+
+        os.replace(f.name, footprint_cache_file)
+
+    except Exception as e:
+        if debugmode:
+            print (e)
+
+# Returns the footprint of an installed kernel on disk (see scan_footprint): all files of the image, modules, extra,
+# and headers packages (from the file lists of dpkg) and its initrd image in /boot. Results are cached until any
+# of the file lists or the initrd image change. Returns None if the kernel is not installed.
+def get_kernel_footprint(kernel, workers = None):
+    global footprint_cache
+
+    if not kernel.installed:
+        return None
+
+    release = get_kernel_release(kernel.package)
+
+    listfiles = [get_dpkg_list_file(kernel.package.replace("-image-", variant)) for variant in ["-image-", "-modules-", "-image-extra-", "-modules-extra-", "-headers-"]]
+    listfiles = [listfile for listfile in listfiles if len(listfile) > 0]
+
+    extra_files = ["/boot/initrd.img-" + release]
+
+    # Key of the cache: modification times of the file lists and the initrd image
+    key = []
+    for filename in listfiles + extra_files:
+        try:
+            key.append("%s:%d" % (filename, os.stat(filename).st_mtime_ns))
+        except OSError:
+            pass
+    key = "|".join(key)
 
-# Installs/Removes/Purges a list of kernels with extra package (if available) and headers
-def perform_kernels(fullnames, verb, xwindow_id = 0, headers = True, extras = True):
-    global cache, debugmode
-    try:
-        if debugmode:        
-            print("Perform_kernels:", fullnames, verb)
+    with footprint_cache_lock:
+        if footprint_cache is None:
+            load_footprint_cache()
 
-        # Our operation list
-        operations = []
+        entry = footprint_cache.get(kernel.package)
+        if entry is not None and entry['key'] == key:
+            return entry['footprint']
 
-        # For each package name check if headers and extras are available and add to list
-        for pkg in fullnames:
+    footprint = scan_footprint(listfiles, extra_files, workers)
 
-            # Is package in cache? Then, ask synaptic to install it
-            if pkg in cache:
-                # Create list of packages to install including headers, modules, extras
-                pkg_list = [cache[pkg].name, cache[pkg].name.replace("-image-", "-modules-")]
+    with footprint_cache_lock:
+        footprint_cache[kernel.package] = {'key': key, 'footprint': footprint}
 
-                if headers:
-                    pkg_list.append(cache[pkg].name.replace("-image-", "-headers-"))
+    return footprint
 
-                if extras:
-                    pkg_list.append(cache[pkg].name.replace("-image-", "-image-extra-"))
-                    pkg_list.append(cache[pkg].name.replace("-image-", "-modules-extra-"))
+# Returns the footprints of all installed kernels of a list (see get_kernel_footprint) as dictionary (package =>
+# footprint); entries of kernels, which are not installed anymore, are removed from the cache
+def get_kernel_footprints(kernels, workers = None):
+    global footprint_cache
 
-                # Add to operations
-                for entry in pkg_list:
-                    if entry in cache:
-                        operations.append( (verb, entry) )
+    footprints = {}
 
-        # Perform actions
-        return pkg_perform_operations(operations, xwindow_id)         
+    for kernel in kernels:
+        footprint = get_kernel_footprint(kernel, workers)
+        if footprint is not None:
+            footprints[kernel.package] = footprint
 
-    # If something is wrong, return an empty list
-    except Exception as e:
-        if debugmode:
-            print (e)
-            print(sys.exc_info())
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            print(exc_type, fname, exc_tb.tb_lineno)
-        return -1
+    with footprint_cache_lock:
+        if footprint_cache is None:
+            load_footprint_cache()
+
+        for package in [package for package in footprint_cache.keys() if package not in footprints]:
+            del footprint_cache[package]
+
+    save_footprint_cache()
+
+    return footprints
 
 # Opens and loads the filter list from ~/.config/kittykernel/blacklist; will create an empty file if the file does not exist!
 def load_blacklist():
@@ -541,47 +1777,94 @@ def load_blacklist():
     # Split lines into KEYWORD and pattern; ignore all lines for which that is not possible
     blacklist = [{'keyword': entry.split(' ', 1)[0].upper(), 'pattern': entry.split(' ', 1)[1]} for entry in blacklist if len(entry.split(' ', 1)) == 2]
 
-    # Return cleaned list
-    return blacklist
+    # Return compiled blacklist
+    return Blacklist(blacklist)
 
-# Applies a blacklist to a kernel list; each entry in 'kernels' needs to have 'version_major', 'package', and 'active'/'installed'/'downloaded' properties
-def apply_blacklist(kernels, blacklist):
-    global debugmode
+# Compiled blacklist: GROUP entries are kept in a set and the patterns of the KERNEL entries are compiled once, and
+# combined into a single regular expression if possible. 'entries' is a list of dictionaries with 'keyword' and
+# 'pattern' (see load_blacklist).
+class Blacklist():
 
-    # Prepare an empty list for the filtered kernels
-    kernels_filtered = []
+    def __init__(self, entries):
+        global debugmode
 
-    # Each entry has to be checked
-    for kernel in kernels:
-        # Flag
-        eliminate = False
-
-        # Check each entry on blacklist
-        for entry in blacklist:
-            # Check GROUP
-            if entry["keyword"] == "GROUP" and entry["pattern"] == kernel["version_major"]:
-                eliminate = True
+        self.entries = entries
+
+        # GROUP entries are compared by string, so a set is enough
+        self.groups = set([entry['pattern'] for entry in entries if entry['keyword'] == 'GROUP'])
+
+        # Compile each KERNEL pattern; ignore the ones, which are not valid regular expressions
+        self.patterns = []
+
+        for entry in entries:
+            if entry['keyword'] != 'KERNEL':
+                continue
+
+            try:
+                self.patterns.append(re.compile(entry['pattern']))
+            except re.error as e:
                 if debugmode:
-                    print("Elimnated group %s" % entry["pattern"])
-                break
+                    print("Invalid pattern '%s' in blacklist: %s" % (entry['pattern'], e))
+
+        # Combine all patterns into one; this is not possible for patterns with back references (they would point
+        # to the wrong group) or flags (they would apply to all patterns)
+        self.combined = None
+
+        if len(self.patterns) > 0 and all([not re.search(r"\\[1-9]|\(\?P=", pattern.pattern) and pattern.flags == re.compile('').flags for pattern in self.patterns]):
+            try:
+                self.combined = re.compile("|".join(["(?:%s)" % pattern.pattern for pattern in self.patterns]))
+            except re.error:
+                self.combined = None
+
+    # For compatibility with the plain list of entries
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Returns True if a kernel is blacklisted; the active, downloaded, and installed kernels are _never_ filtered
+    def is_blacklisted(self, kernel):
+        global debugmode
 
-            # Check KERNEL
-            if entry["keyword"] == "KERNEL" and re.match(entry["pattern"], kernel["package"]):
-                eliminate = True
+        if kernel.active or kernel.installed or kernel.downloaded:
+            return False
+
+        # Check GROUP
+        if kernel.version_major in self.groups:
+            if debugmode:
+                print("Elimnated group %s" % kernel.version_major)
+            return True
+
+        # Check KERNEL
+        if self.combined is not None:
+            if self.combined.match(kernel.package):
                 if debugmode:
-                    print("Elimnated kernel '%s' with pattern '%s'" % (kernel["package"], entry["pattern"]))
-                break
+                    print("Elimnated kernel '%s'" % kernel.package)
+                return True
+
+            return False
+
+        for pattern in self.patterns:
+            if pattern.match(kernel.package):
+                if debugmode:
+                    print("Elimnated kernel '%s' with pattern '%s'" % (kernel.package, pattern.pattern))
+                return True
+
+        return False
 
-        # The active, downloaded, and installed kernels are _never_ filtered
-        if kernel["active"] or kernel['installed'] or kernel['downloaded']:
-            eliminate = False
+    # Returns a list of all kernels, which are not blacklisted
+    def filter(self, kernels):
+        return [kernel for kernel in kernels if not self.is_blacklisted(kernel)]
 
-        # If not eliminated then add to filtered list
-        if not eliminate:
-            kernels_filtered.append(kernel)
+# Applies a blacklist to a kernel list; each entry in 'kernels' needs to have 'version_major', 'package', and 'active'/'installed'/'downloaded' properties;
+# blacklist can be a Blacklist object or a list of entries (see load_blacklist)
+def apply_blacklist(kernels, blacklist):
+    if not isinstance(blacklist, Blacklist):
+        blacklist = Blacklist(blacklist)
 
     # Return filtered list
-    return kernels_filtered
+    return blacklist.filter(kernels)
 
 # Resets the blacklist
 def reset_blacklist():
@@ -599,7 +1882,156 @@ def reset_blacklist():
     with open(blacklist_file, "w+") as f:
         f.writelines(default_blacklist)
 
-# Returns the number of files, which are downloaded from this kernel
+# Returns the data file and the meta file (ETag, Last-Modified, etc) of an url in the metadata cache
+def get_http_cache_files(url):
+    # Create directory if it does not exist, yet
+    os.makedirs(http_cache_path, exist_ok=True)
+
+    # Files are named by the hash of the url
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    return (http_cache_path + "/" + key, http_cache_path + "/" + key + ".meta")
+
+# Writes data to a file in the metadata cache; the data is written to a temporary file first and then moved,
+# so other threads or processes never see a half-written file
+def write_http_cache_file(filename, data):
+    with tempfile.NamedTemporaryFile(dir = http_cache_path, prefix = "tmp", delete = False) as f:
+        f.write(data)
+
+    os.replace(f.name, filename)
+
+# Downloads an url through the metadata cache and returns its content as bytes. Cached urls are revalidated
+# with a conditional request (ETag/Last-Modified); immutable urls (e.g. files in a version directory of the
+# Ubuntu mainline archive) are not revalidated at all once they are older than http_cache_grace. If the
+# server cannot be reached, a cached copy is returned. Raises an exception if there is no data at all.
+def http_get(url, immutable = False):
+    global debugmode
+
+    datafile, metafile = get_http_cache_files(url)
+
+    # Load the meta data of the cached copy, if there is any
+    meta = None
+    try:
+        if os.path.isfile(datafile):
+            with open(metafile, "r") as f:
+                meta = json.load(f)
+    except Exception as e:
+        if debugmode:
+            print (e)
+        meta = None
+
+    # Immutable and old enough? Then there is no need to ask the server at all; the modification time
+    # of the data file is used as access time for the eviction
+    if meta is not None and immutable and time.time() - meta['modified'] > http_cache_grace:
+        os.utime(datafile)
+        with open(datafile, "rb") as f:
+            return f.read()
+
+    # Prepare a conditional request
+    request = urllib.request.Request(url)
+
+    if meta is not None:
+        if meta['etag']:
+            request.add_header("If-None-Match", meta['etag'])
+        if meta['last_modified']:
+            request.add_header("If-Modified-Since", meta['last_modified'])
+
+    try:
+        with urllib.request.urlopen(request) as urlfile:
+            data = urlfile.read()
+            headers = urlfile.headers
+
+    except Exception as e:
+        # Not modified (HTTP 304) or no connection; in both cases the cached copy is used (if there is one)
+        if meta is None:
+            raise
+
+        if debugmode:
+            print("Using cached copy of %s (%s)" % (url, e))
+
+        os.utime(datafile)
+        with open(datafile, "rb") as f:
+            return f.read()
+
+    # Time of last modification on the server; if the server does not say anything (e.g. directory listings), then
+    # the time the entry was first seen is kept as long as the data did not change, otherwise the grace period would
+    # never run out for entries, which are requested more often than http_cache_grace
+    modified = time.time()
+    try:
+        if headers.get("Last-Modified"):
+            modified = email.utils.parsedate_to_datetime(headers.get("Last-Modified")).timestamp()
+        elif meta is not None:
+            with open(datafile, "rb") as f:
+                if f.read() == data:
+                    modified = meta['modified']
+    except Exception as e:
+        if debugmode:
+            print (e)
+
+    # Save data and meta data; data first, so there is never meta data without data
+    meta = {'url': url, 'etag': headers.get("ETag", ""), 'last_modified': headers.get("Last-Modified", ""), 'modified': modified}
+
+    write_http_cache_file(datafile, data)
+    write_http_cache_file(metafile, json.dumps(meta).encode("utf-8"))
+
+    return data
+
+# Removes entries from the metadata cache, which were not used for 'maxage' days, and then the least recently
+# used entries until the cache is smaller than 'maxsize' bytes; None means the values from config are used
+def prune_http_cache(maxsize = None, maxage = None):
+    global debugmode
+
+    try:
+        if maxsize is None or maxage is None:
+            config = load_config()
+            maxsize = [int(config['Cache']['maxsize']) if maxsize is None else maxsize][0]
+            maxage = [int(config['Cache']['maxage']) if maxage is None else maxage][0]
+
+        if not os.path.isdir(http_cache_path):
+            return
+
+        now = time.time()
+
+        # Collect all data files as tuples (last access, size, name); left-over temporary files are removed
+        # if they are older than a day (they could be still used otherwise)
+        entries = []
+
+        for entry in os.scandir(http_cache_path):
+            if entry.name.endswith(".meta"):
+                continue
+
+            stat = entry.stat()
+
+            if entry.name.startswith("tmp"):
+                if now - stat.st_mtime > 24*60*60:
+                    os.remove(entry.path)
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        # Newest first; keep everything until the size or age limit is reached
+        entries.sort(reverse = True)
+
+        totalsize = 0
+        for accessed, size, datafile in entries:
+            totalsize += size
+
+            if totalsize <= maxsize and now - accessed <= maxage*24*60*60:
+                continue
+
+            if debugmode:
+                print("Evicting %s from metadata cache" % datafile)
+
+            os.remove(datafile)
+
+            if os.path.isfile(datafile + ".meta"):
+                os.remove(datafile + ".meta")
+
+    except Exception as e:
+        if debugmode:
+            print (e)
+
+# Returns the number of files, which are downloaded from this kernel; files with a wrong checksum are not counted
 def ubuntu_kernel_downloaded_files(kernel):
     global debugmode
 
@@ -612,8 +2044,8 @@ def ubuntu_kernel_downloaded_files(kernel):
     no_files = 0
   
     # Download each file; check for existance first; file is tuple (name, date, size)
-    for file in kernel['files']:
-        outputfile = downloadto + "/" + file[0]
+    for file in kernel.files:
+        outputfile = downloadto + "/" + file.name
 
         if os.path.isfile(outputfile):
             if debugmode:
@@ -621,16 +2053,193 @@ def ubuntu_kernel_downloaded_files(kernel):
 
             no_files += 1       
 
+    # Verify the files (only if there are any; verified files are cached, so this is usually free)
+    if no_files > 0:
+        no_files -= list(verify_ubuntu_kernel_files(kernel).values()).count(False)
+
     # Return number of files
     return no_files
 
-# Download a file for an Ubuntu kernel; redownload will remove existing files and download them again
-# Returns False if there was an exception
-def download_ubuntu_kernel_file(kernel, index, redownload = False):
+# Downloads and parses the CHECKSUMS file of an Ubuntu kernel; returns a dictionary with the file name as key
+# and a tuple (algorithm, hex digest) as value. Sha256 is preferred over Sha1. Empty if something went wrong.
+def get_ubuntu_kernel_checksums(kernel):
+    global debugmode
+
+    if len(kernel.checksums_url) == 0:
+        return {}
+
+    try:
+        lines = http_get(kernel.checksums_url, immutable = True).decode("utf-8").splitlines()
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return {}
+
+    # The file consists of sections such as '# Checksums-Sha1:' followed by lines '<hex digest>  <file name>'
+    algorithms = {'# Checksums-Sha1:': 'sha1', '# Checksums-Sha256:': 'sha256'}
+    algorithm = ''
+
+    checksums = {}
+
+    for line in lines:
+        if line.strip() in algorithms:
+            algorithm = algorithms[line.strip()]
+            continue
+
+        if len(algorithm) == 0 or line.startswith('#') or len(line.split()) != 2:
+            continue
+
+        digest, filename = line.split()
+        filename = filename.lstrip('*')
+
+        # Sha1 is only used if there is nothing better
+        if filename in checksums and algorithm == 'sha1':
+            continue
+
+        checksums[filename] = (algorithm, digest.lower())
+
+    return checksums
+
+# Calculates the checksum of a file (hex digest); the file is read in blocks into the same buffer, so this
+# works fine with large files
+def get_file_checksum(filename, algorithm):
+    checksum = hashlib.new(algorithm)
+
+    buffer = bytearray(checksum_block_size)
+    view = memoryview(buffer)
+
+    with open(filename, "rb", buffering = 0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+
+            checksum.update(view[:size])
+
+    return checksum.hexdigest()
+
+# Returns the checksum of a file from the digest cache or calculates it (and adds it to the cache); the key
+# includes modification time and size, so a changed file is always checked again
+def get_file_checksum_cached(filename, algorithm):
+    global digest_cache
+
+    stat = os.stat(filename)
+    key = "%s|%d|%d|%s" % (filename, stat.st_mtime_ns, stat.st_size, algorithm)
+
+    with digest_cache_lock:
+        if digest_cache is None:
+            load_digest_cache()
+
+        if key in digest_cache:
+            return digest_cache[key]
+
+    digest = get_file_checksum(filename, algorithm)
+
+    with digest_cache_lock:
+        digest_cache[key] = digest
+
+    return digest
+
+# Loads the digest cache from file; entries for files that do not exist anymore are dropped
+def load_digest_cache():
+    global digest_cache, debugmode
+
+    digest_cache = {}
+
+    try:
+        if os.path.isfile(digest_cache_file):
+            with open(digest_cache_file, "r") as f:
+                digest_cache = json.load(f)
+
+        digest_cache = {key: value for key, value in digest_cache.items() if os.path.isfile(key.split('|', 1)[0])}
+
+    except Exception as e:
+        if debugmode:
+            print (e)
+        digest_cache = {}
+
+# Saves the digest cache to file
+def save_digest_cache():
+    global debugmode
+
+    try:
+        with digest_cache_lock:
+            if digest_cache is None:
+                return
+
+            data = json.dumps(digest_cache)
+
+        os.makedirs(os.path.dirname(digest_cache_file), exist_ok=True)
+
+        # Write to a temporary file first; several threads could save the cache at the same time
+        with tempfile.NamedTemporaryFile("w", dir = os.path.dirname(digest_cache_file), delete = False) as f:
+            f.write(data)
+
+        os.replace(f.name, digest_cache_file)
+
+    except Exception as e:
+        if debugmode:
+            print (e)
+
+# Verifies the downloaded files of an Ubuntu kernel with the CHECKSUMS file of its version; the files are checked
+# in parallel by 'workers' threads (None = value from config). Returns a dictionary with the file name as key
+# and True (checksum ok), False (checksum wrong), or None (no checksum available) as value; files, which
+# are not downloaded, are not in the dictionary.
+def verify_ubuntu_kernel_files(kernel, workers = None):
+    global debugmode
+
+    # Download path
+    downloadto = os.path.expanduser("~/.config/kittykernel/ubuntu")
+
+    # Only files, which are there, can be checked
+    filenames = [file.name for file in kernel.files if os.path.isfile(downloadto + "/" + file.name)]
+
+    if len(filenames) == 0:
+        return {}
+
+    checksums = get_ubuntu_kernel_checksums(kernel)
+
+    # Checks a single file
+    def verify(filename):
+        if filename not in checksums:
+            return None
+
+        try:
+            algorithm, digest = checksums[filename]
+            return get_file_checksum_cached(downloadto + "/" + filename, algorithm) == digest
+
+        except Exception as e:
+            if debugmode:
+                print (e)
+            return False
+
+    if workers is None:
+        workers = get_mainline_workers()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+        results = dict(zip(filenames, executor.map(verify, filenames)))
+
+    save_digest_cache()
+
+    if debugmode:
+        print("Verified files: ", results)
+
+    return results
+
+# Returns how much the real size of a file may differ from the size given in the directory listing of the
+# Ubuntu mainline archive; the listing only shows sizes rounded to K or M
+def get_listing_size_tolerance(size):
+    return [1024*1024 if size >= 1024*1024 else 1024][0]
+
+# Download a file for an Ubuntu kernel; redownload will remove existing files and download them again. The file
+# is downloaded to a '.part' file first, which is resumed if it exists (HTTP Range request) and renamed when
+# the download is complete and the size is correct. 'progress' can be a function, which is called with
+# (index, bytes downloaded so far) after each block. Returns False if the file could not be downloaded.
+def download_ubuntu_kernel_file(kernel, index, redownload = False, progress = None):
     global debugmode
 
     # File in there?
-    if not 0 <= index < len(kernel['files']):
+    if not 0 <= index < len(kernel.files):
         return False
 
     # Download path
@@ -641,29 +2250,89 @@ def download_ubuntu_kernel_file(kernel, index, redownload = False):
 
     try:
         # Download the file; check for existance first; file is tuple (name, date, size)
-        file = kernel['files'][index]
+        file = kernel.files[index]
 
-        inputurl = kernel['url'] + file[0]
-        outputfile = downloadto + "/" + file[0]
+        inputurl = kernel.url + file.name
+        outputfile = downloadto + "/" + file.name
+        partfile = outputfile + ".part"
 
         if debugmode:
-            print("Download %s to %s" % (file[0], outputfile))
+            print("Download %s to %s" % (file.name, outputfile))
 
-        if os.path.isfile(outputfile) and redownload:
-            os.remove(outputfile)
+        if redownload:
+            for filename in [outputfile, partfile]:
+                if os.path.isfile(filename):
+                    os.remove(filename)
 
-            if debugmode:
-                print("File exists. Removing.")
+                    if debugmode:
+                        print("File exists. Removing.")
 
         if os.path.isfile(outputfile):
             if debugmode:
                 print("File exists. Skipping.")      
             return True      
 
-        (filename, headers) = urllib.request.urlretrieve(inputurl, outputfile)
+        # Resume a previous download if there is a part file
+        offset = [os.path.getsize(partfile) if os.path.isfile(partfile) else 0][0]
+        expected_size = -1
 
-        if debugmode:
-            print(filename, headers)
+        request = urllib.request.Request(inputurl)
+        if offset > 0:
+            request.add_header("Range", "bytes=%d-" % offset)
+
+            if debugmode:
+                print("Resuming at %d bytes." % offset)
+
+        try:
+            urlfile = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            # Range not satisfiable: the part file has already everything (checked below)
+            if e.code != 416 or offset == 0:
+                raise
+            urlfile = None
+
+        if urlfile is not None:
+            with urlfile:
+                # Server ignores range requests? Then start from the beginning
+                if offset > 0 and urlfile.status != 206:
+                    offset = 0
+
+                # Full size of the file, either from 'Content-Range: bytes 100-999/1000' or 'Content-Length'
+                if urlfile.status == 206 and "/" in urlfile.headers.get("Content-Range", ""):
+                    total = urlfile.headers.get("Content-Range").rsplit("/", 1)[1]
+                    expected_size = [int(total) if total.isdigit() else -1][0]
+                elif urlfile.headers.get("Content-Length", "").isdigit():
+                    expected_size = offset + int(urlfile.headers.get("Content-Length"))
+
+                with open(partfile, ["ab" if offset > 0 else "wb"][0]) as f:
+                    while True:
+                        block = urlfile.read(download_block_size)
+                        if not block:
+                            break
+
+                        f.write(block)
+                        offset += len(block)
+
+                        if progress is not None:
+                            progress(index, offset)
+
+        size = os.path.getsize(partfile)
+
+        # Incomplete? Keep the part file, so the download can be resumed next time
+        if expected_size >= 0 and size != expected_size:
+            if debugmode:
+                print("Download incomplete: %d of %d bytes." % (size, expected_size))
+            return False
+
+        # Size does not match the directory listing? Then the part file is broken
+        if abs(size - file.size) > get_listing_size_tolerance(file.size):
+            if debugmode:
+                print("Size mismatch: %d bytes, expected about %d bytes. Removing." % (size, file.size))
+            os.remove(partfile)
+            return False
+
+        # Everything is fine, so finally rename the file
+        os.replace(partfile, outputfile)
 
     except Exception as e:
         if debugmode:
@@ -677,40 +2346,32 @@ def download_ubuntu_kernel_file(kernel, index, redownload = False):
     # Return successfully
     return True
 
-# Check Ubuntu kernel file size
-def get_ubuntu_kernel_file_size(kernel, index):
+# Downloads all files of an Ubuntu kernel in parallel by 'workers' threads (None = value from config) and verifies
+# them; see download_ubuntu_kernel_file for 'redownload' and 'progress'. Returns False if any file could not be
+# downloaded or has a wrong checksum.
+def download_ubuntu_kernel_files(kernel, redownload = False, workers = None, progress = None):
     global debugmode
 
-    # File in there?
-    if not 0 <= index < len(kernel['files']):
-        return 0
+    if workers is None:
+        workers = get_mainline_workers()
 
-    # Download path
-    downloadto = os.path.expanduser("~/.config/kittykernel/ubuntu")
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(download_ubuntu_kernel_file, kernel, index, redownload, progress) for index in range(len(kernel.files))]
 
-    # Create directory if it does not exist, yet
-    os.makedirs(downloadto, exist_ok=True)
+    result = all([future.result() for future in futures])
 
-    try:
-        # Download the file; check for existance first; file is tuple (name, date, size)
-        file = kernel['files'][index]
-        
-        downloadfile = downloadto + "/" + file[0]        
+    # Verify the checksums; files with a wrong checksum are removed, so they are downloaded again next time
+    downloadto = os.path.expanduser("~/.config/kittykernel/ubuntu")
 
-        if os.path.isfile(downloadfile):
+    for filename, verified in verify_ubuntu_kernel_files(kernel, workers).items():
+        if verified is False:
             if debugmode:
-                print("File exists. Get size: " +  os.path.getsize(downloadfile))      
-            return os.path.getsize(downloadfile)      
+                print("Wrong checksum: %s. Removing." % filename)
 
-    except Exception as e:
-        if debugmode:
-            print (e)
-            print(sys.exc_info())
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            print(exc_type, fname, exc_tb.tb_lineno)
+            os.remove(downloadto + "/" + filename)
+            result = False
 
-    return 0
+    return result
 
 # Removes the files for this Ubuntu kernel
 def remove_ubuntu_kernel_files(kernel):
@@ -724,20 +2385,22 @@ def remove_ubuntu_kernel_files(kernel):
 
     try:
         # Remove all files that exists; file is tuple (name, date, size)
-        for file in kernel['files']:     
-            downloadfile = downloadto + "/" + file[0]
+        for file in kernel.files:     
+            downloadfile = downloadto + "/" + file.name
 
-            if debugmode:
-                print("Removing %s" % (downloadfile))
+            # Remove partly downloaded files as well
+            for filename in [downloadfile, downloadfile + ".part"]:
+                if debugmode:
+                    print("Removing %s" % (filename))
 
-            if os.path.isfile(downloadfile):
-                os.remove(downloadfile)
+                if os.path.isfile(filename):
+                    os.remove(filename)
 
-                if debugmode:
-                    print("File exists. Removing.")
-            else:
-                if debugmode:
-                    print("File does not exists. Skipping.")
+                    if debugmode:
+                        print("File exists. Removing.")
+                else:
+                    if debugmode:
+                        print("File does not exists. Skipping.")
 
     except Exception as e:
         if debugmode:
@@ -758,14 +2421,13 @@ def get_ubuntu_kernel_info(suburl):
 
     arch = ['amd64' if platformis64bit else 'i386'][0]
 
-    # Create an empty dictionary object; create version from url
-    kernel = {  'version_major': '', 'version': '', 'url': '', 'changes': '', 'package': '', 'size': 0, 'active': False, 'downloaded': False, 'installed': False, 'files': [], 
-                'downloaded_files': 0}
+    # Create an empty kernel record; create version from url
+    kernel = KernelRecord()
 
     try:
-        kernel['version_major'] = re.findall(u"v([0-9]+\.[0-9]+)", suburl)[0]
-        kernel['version'] = re.findall(u"v([0-9]+\.[0-9]+.*)/", suburl)[0]
-        kernel['url'] = "http://kernel.ubuntu.com/~kernel-ppa/mainline/" + suburl
+        kernel.version_major = re.findall(u"v([0-9]+\.[0-9]+)", suburl)[0]
+        kernel.version = re.findall(u"v([0-9]+\.[0-9]+.*)/", suburl)[0]
+        kernel.url = "http://kernel.ubuntu.com/~kernel-ppa/mainline/" + suburl
 
     except:
         return []
@@ -773,8 +2435,7 @@ def get_ubuntu_kernel_info(suburl):
     # Download info about all related files; sort by name (C=N), descending (O=D), fancy HTML (F=2) for getting disk size and co
     kernel_info_html = ""
     try:
-        with urllib.request.urlopen(kernel['url'] + "?C=N&O=D&F=2") as urlfile:
-            kernel_info_html = urlfile.read().decode("utf-8")
+        kernel_info_html = http_get(kernel.url + "?C=N&O=D&F=2", immutable = True).decode("utf-8")
     except:
         return []
 
@@ -811,10 +2472,13 @@ def get_ubuntu_kernel_info(suburl):
             for index, _ in enumerate(columns):
                 columns[index] = columns[index].strip().replace('&nbsp;', '')
 
-            # Changes file? Download and save
+            # Changes file? Remember the url; the file itself is downloaded when needed (see get_ubuntu_kernel_changes)
             if columns[1] == 'CHANGES':
-                with urllib.request.urlopen(kernel['url'] + "CHANGES") as changesfile:
-                    kernel['changes'] = changesfile.read().decode("utf-8")
+                kernel.changes_url = kernel.url + "CHANGES"
+
+            # Checksums file? Remember the url as well (see verify_ubuntu_kernel_files)
+            if columns[1] == 'CHECKSUMS':
+                kernel.checksums_url = kernel.url + "CHECKSUMS"
 
             # Only process necessary files for the kernel
             if not columns[1].startswith('linux-'):
@@ -826,10 +2490,10 @@ def get_ubuntu_kernel_info(suburl):
                 if columns[1].startswith('linux-image-'):
                     a = columns[1].find('_')
                     if a is not -1:
-                        kernel['package'] = columns[1][:a]
-                        b = kernel['package'].rfind('-')
+                        kernel.package = columns[1][:a]
+                        b = kernel.package.rfind('-')
                         if b is not -1:
-                            kernel['package'] = kernel['package'][:b]
+                            kernel.package = kernel.package[:b]
                         
                 # Process size
                 size_data = re.findall(u"^([0-9]+\.?[0-9]*)([KM])", columns[3])[0]
@@ -839,8 +2503,8 @@ def get_ubuntu_kernel_info(suburl):
                 if size_data[1] in ['K', 'M']:
                     size *= int([1024 if size_data[1] == 'K' else 1024*1024][0])
 
-                # Add to files as a tuple
-                files.append((columns[1], columns[2], size))         
+                # Add to files
+                files.append(KernelFile(columns[1], columns[2], size))         
 
     except:
         return []
@@ -854,9 +2518,9 @@ def get_ubuntu_kernel_info(suburl):
         for file in files:
             # Extract group
             group = ''
-            a = file[0].find('_')
+            a = file.name.find('_')
             if a is not -1:
-                group = file[0][:a]
+                group = file.name[:a]
                 b = group.rfind('-')
                 if b is not -1:
                     group = group[b+1:]
@@ -872,23 +2536,26 @@ def get_ubuntu_kernel_info(suburl):
         for group in groups:
             kernels.append(kernel.copy())
 
-            kernels[-1]['package'] = kernels[-1]['package'] + '-' + group
-            kernels[-1]['files'] = [] # This is important, otherwise all kernel objects will share the same file list (Python does not copy by default)
-            kernels[-1]['size'] = 0
+            kernels[-1].package = kernels[-1].package + '-' + group
+
+            group_files = []
 
             for file in files:
                 # Get kernel root from filename
-                rootname = file[0]
+                rootname = file.name
                 a = rootname.find('_')
                 if a is not -1:
                     rootname = rootname[:a]
 
                 # -all files for all \o/
-                if re.match(u"^linux-(.*)-" + group + "$", rootname) or re.match(u"linux-(.+?)_all.deb", file[0]):
-                    kernels[-1]['files'].append(file)
-                    kernels[-1]['size'] += file[2]
+                if re.match(u"^linux-(.*)-" + group + "$", rootname) or re.match(u"linux-(.+?)_all.deb", file.name):
+                    group_files.append(file)
+
+            # Files are saved as tuple, so that copies of the record can share them
+            kernels[-1].files = tuple(group_files)
+            kernels[-1].size = sum([file.size for file in group_files])
 
-            kernels[-1]['downloaded_files'] = ubuntu_kernel_downloaded_files(kernels[-1])
+            kernels[-1].downloaded_files = ubuntu_kernel_downloaded_files(kernels[-1])
 
     except:
         return []        
@@ -896,16 +2563,64 @@ def get_ubuntu_kernel_info(suburl):
     return kernels
 
 
-# Downloads a list of Ubuntu kernels; returns an empty list if something goes wrong
-def get_ubuntu_kernels(ignore_drm = True, ignore_before4 = True):
+# Returns the number of parallel connections used for the Ubuntu mainline archive (from config, at least 1)
+def get_mainline_workers():
+    global debugmode
+    try:
+        return max(1, int(load_config()['Mainline']['workers']))
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return int(config_default['Mainline']['workers'])
+
+# Returns the CHANGES file of an Ubuntu kernel if it was loaded recently; None otherwise
+def get_cached_ubuntu_kernel_changes(kernel):
+    with ubuntu_changes_lock:
+        if kernel.changes_url not in ubuntu_changes_cache:
+            return None
+
+        ubuntu_changes_cache.move_to_end(kernel.changes_url)
+        return ubuntu_changes_cache[kernel.changes_url]
+
+# Returns the CHANGES file of an Ubuntu kernel; downloads it through the metadata cache if it was not loaded
+# recently. Returns an empty string if the kernel has no CHANGES file or something went wrong.
+def get_ubuntu_kernel_changes(kernel):
+    global debugmode
+
+    if len(kernel.changes_url) == 0:
+        return ""
+
+    changes = get_cached_ubuntu_kernel_changes(kernel)
+    if changes is not None:
+        return changes
+
+    try:
+        changes = http_get(kernel.changes_url, immutable = True).decode("utf-8")
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return ""
+
+    # Keep in memory; throw out the least recently used one if there are too many
+    with ubuntu_changes_lock:
+        ubuntu_changes_cache[kernel.changes_url] = changes
+
+        while len(ubuntu_changes_cache) > ubuntu_changes_cache_size:
+            ubuntu_changes_cache.popitem(last = False)
+
+    return changes
+
+# Downloads a list of Ubuntu kernels; returns an empty list if something goes wrong. The pages of the single
+# versions are downloaded in parallel by 'workers' threads (None = value from config); 'progress' can be a
+# function, which is called with (pages done, pages total) each time a page is finished
+def get_ubuntu_kernels(ignore_drm = True, ignore_before4 = True, workers = None, progress = None):
     # Prepare list
     kernel_list = []    
 
     # Download list of kernels; sort by name (C=N), descending (O=D), no fancy HTML (F=0)
     kernel_list_html = ""
     try:
-        with urllib.request.urlopen("http://kernel.ubuntu.com/~kernel-ppa/mainline/?C=N&O=D&F=0") as urlfile:
-            kernel_list_html = urlfile.read().decode("utf-8")
+        kernel_list_html = http_get("http://kernel.ubuntu.com/~kernel-ppa/mainline/?C=N&O=D&F=0").decode("utf-8")
     except:
         return []
 
@@ -920,6 +2635,9 @@ def get_ubuntu_kernels(ignore_drm = True, ignore_before4 = True):
         pattern = re.compile(u"<a href=\"(.+?)\">", re.UNICODE)
         kernel_list_html = re.findall(pattern, kernel_list_html)
 
+        # First, collect all the subdirectories we are interested in (this is fast, no network involved)
+        entries = []
+
         previous_version = "1.0"
         for entry in kernel_list_html: 
             # Ignore 'X' and all files
@@ -941,14 +2659,34 @@ def get_ubuntu_kernels(ignore_drm = True, ignore_before4 = True):
 
             previous_version = version
 
-            kernelpkgs = get_ubuntu_kernel_info(entry)
+            entries.append(entry)
+
+        # Second, download the information for each version in parallel; the futures are kept in the
+        # order of the entries, so the list stays sorted in descending order
+        if workers is None:
+            workers = get_mainline_workers()
 
-            for pkg in kernelpkgs:
-                kernel_list.append(pkg)
+        pages_done = 0
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+            futures = [executor.submit(get_ubuntu_kernel_info, entry) for entry in entries]
+
+            # Report progress as soon as any page is finished
+            for future in concurrent.futures.as_completed(futures):
+                pages_done += 1
+                if progress is not None:
+                    progress(pages_done, len(futures))
+
+            for future in futures:
+                for pkg in future.result():
+                    kernel_list.append(pkg)
 
     except:
         return []
 
+    # Keep the metadata cache small
+    prune_http_cache()
+
     # Return the list
     return kernel_list
 
@@ -960,6 +2698,15 @@ if __name__ == '__main__':
     # Test kernel stripping
     print("Kernel strip for 'linux-image-4.8.0-46-generic' results in: ", strip_kernel_version("linux-image-4.8.0-46-generic"))
 
+    # Test version comparison: (version1, version2, expected result)
+    for version1, version2, expected in [("4.15", "4.4", 1), ("4.10.0", "4.10", 0), ("4.10.0-28", "4.10.0-28", 0),
+                                         ("4.15.0-24.26~16.04.1", "4.15.0-24.26", -1), ("4.15.0-24.26~16.04.1", "4.15.0-23.25", 1),
+                                         ("4.15.0-24.26~16.04.1", "4.15.0-24.26~16.04.2", -1), ("4.15.0-24.26~16.04.1", "4.15.0-24.26~14.04.1", 1),
+                                         ("4.4.0-130.156", "4.4.0-98.121", 1), ("4.13.0-45.50~16.04.1", "4.13.0-45.50~16.04.1", 0),
+                                         ("1:4.4.0-21.37", "4.15.0-24.26", 1), ("4.10.0-28.32~16.04.2", "4.10.0-28.32~16.04.2~1", 1)]:
+        result = compare_versions(version1, version2)
+        print("Compare '%s' with '%s': %d (%s)" % (version1, version2, result, ["ok" if result == expected else "FAILED"][0]))
+
     # Debug mode on
     debugmode = True
 
@@ -970,11 +2717,54 @@ if __name__ == '__main__':
 
     print("Current kernel: ", get_current_kernel())
     print("Size of boot: ", sizeof_boot())
+
+    # Benchmark: scanning all packages of the cache (as kittykernel did before: a package object, its architecture,
+    # and a dictionary for every package) vs. scanning the names only; best of three runs each
+    debugmode = False
+
+    cache = get_cache()
+
+    def scan_all_packages():
+        found = []
+        for pkg in cache:
+            if (pkg.architecture() == "amd64") != platformis64bit:
+                continue
+
+            kernel = { 'version_major': '', 'version': '', 'package': pkg.name, 'pkg_version': '',
+                       'size': 0, 'installed_size': 0, 'origins': [], 'fullname': pkg.fullname,
+                       'active': False, 'installed': False, 'downloaded': False }
+
+            if kernel['package'].startswith( tuple(["linux-image-"+str(x) for x in range(1,6)]) ):
+                found.append(kernel)
+        return found
+
+    times = []
+    for run in range(3):
+        timestart = time.perf_counter()
+        kernels = scan_all_packages()
+        times.append(time.perf_counter() - timestart)
+    time_before = min(times)
+    print("Scan of all %d packages: %.3f s (%d kernel packages)" % (len(cache), time_before, len(kernels)))
+
+    times = []
+    for run in range(3):
+        timestart = time.perf_counter()
+        kernels = get_kernels(use_snapshot = False)
+        times.append(time.perf_counter() - timestart)
+    time_after = min(times)
+    print("Scan of package names: %.3f s (%d kernels), %.1f times faster" % (time_after, len(kernels), time_before / max(time_after, 1e-9)))
+
+    timestart = time.perf_counter()
+    kernels = get_kernels()
+    print("Kernel list from snapshot: %.3f s (%d kernels)" % (time.perf_counter() - timestart, len(kernels)))
+
+    debugmode = True
+
     kernels = get_kernels()
     print("Kernel list: ", )
 
     if len(kernels) > 0:
-        print("Changelog of first entry %s:" % kernels[0]["fullname"], get_kernel_changelog(kernels[0]["fullname"]))
+        print("Changelog of first entry %s:" % kernels[0].fullname, get_kernel_changelog(kernels[0].fullname))
 
     print("Load filters: ")
     blacklist = load_blacklist()
@@ -983,7 +2773,36 @@ if __name__ == '__main__':
     print("Kernels with applied blacklist:")
     kernels = apply_blacklist(kernels, blacklist)
     for entry in kernels:
-        print(entry["package"])
+        print(entry.package)
+
+    # Benchmark: applying a blacklist with many rules to many kernels (the old way vs. the compiled blacklist)
+    debugmode = False
+
+    test_kernels = [KernelRecord(version_major = "4.%d" % (x % 20), package = "linux-image-4.%d.0-%d-%s" % (x % 20, x, ['generic', 'lowlatency', 'azure'][x % 3]),
+                                 installed = (x % 100 == 0)) for x in range(5000)]
+    test_rules = [{'keyword': 'GROUP', 'pattern': "3.%d" % x} for x in range(500)] + \
+                 [{'keyword': 'KERNEL', 'pattern': ".*-flavour%d$" % x} for x in range(500)] + \
+                 [{'keyword': 'KERNEL', 'pattern': ".*-azure$"}]
+
+    timestart = time.perf_counter()
+    test_filtered = [kernel for kernel in test_kernels if kernel.installed or not any([(entry['keyword'] == 'GROUP' and entry['pattern'] == kernel.version_major) or 
+                                                        (entry['keyword'] == 'KERNEL' and re.match(entry['pattern'], kernel.package)) for entry in test_rules])]
+    print("Blacklist, %d kernels and %d rules, uncompiled: %.3f s (%d kernels left)" % (len(test_kernels), len(test_rules), time.perf_counter() - timestart, len(test_filtered)))
+
+    timestart = time.perf_counter()
+    test_filtered = Blacklist(test_rules).filter(test_kernels)
+    print("Blacklist, %d kernels and %d rules, compiled: %.3f s (%d kernels left)" % (len(test_kernels), len(test_rules), time.perf_counter() - timestart, len(test_filtered)))
+
+    # Test the autoclean policy: (keep, expected kernels to purge); the kernel newer than the active one (4.15.0-32)
+    # was just installed and is always kept
+    test_kernels = [KernelRecord(package = "linux-image-4.15.0-%d-generic" % x, installed = True, active = (x == 30)) for x in [32, 30, 29, 24]]
+
+    for keep, expected in [(0, [29, 24]), (1, [29, 24]), (2, [24]), (3, [])]:
+        result = [kernel.package for kernel in get_autoclean_kernels(test_kernels, {'keep': keep, 'keep_known_good': False})]
+        expected = ["linux-image-4.15.0-%d-generic" % x for x in expected]
+        print("Autoclean with keep = %d: %s (%s)" % (keep, result, ["ok" if result == expected else "FAILED"][0]))
+
+    debugmode = True
 
     print("Get support list:", get_kernel_support_times())
 
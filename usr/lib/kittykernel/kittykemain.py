@@ -66,6 +66,10 @@ class Columns(Enum):
     KITTYKE_DATA_INDEX = 8
 
 
+# Number of sections (versions) of a changelog, which are loaded at once (see KittykeMainWindow.show_changelog)
+changelog_sections_per_load = 25
+
+
 # KittykeMainWindow class is the main class of the application; it is responsible for the main window
 class KittykeMainWindow():
 
@@ -83,8 +87,10 @@ class KittykeMainWindow():
             self.builder.add_from_file("/usr/lib/kittykernel/kittykernel.ui")
             self.builder.connect_signals(self)
 
-            # Save the current theme
+            # Save the current theme; icons are loaded only once (see get_icon) until the theme changes
             self.theme = Gtk.IconTheme.get_default()                            
+            self.icons = {}
+            self.theme.connect("changed", self.on_theme_changed)
 
             # Setup the treeview
             self.setup_treeview()
@@ -97,6 +103,15 @@ class KittykeMainWindow():
             self.changelogview.modify_font(Pango.FontDescription("Monospace")) 
             self.changelogs = []
 
+            # Major version of the changelog shown and number of its sections loaded so far; more sections are
+            # loaded when the user scrolls down (see show_changelog)
+            self.changelog_major = None
+            self.changelog_loaded = 0
+            self.changelogview.get_vadjustment().connect("value-changed", self.on_changelog_scrolled)
+
+            # Ubuntu kernel, for which the CHANGES file should be shown
+            self.changes_kernel = None
+
             # Main window handle
             self.window = self.builder.get_object("kittykewindow")
             self.window.set_icon_from_file("/usr/lib/kittykernel/kittykernel.svg")
@@ -106,6 +121,12 @@ class KittykeMainWindow():
             self.kernels = []
             self.kernels_ubuntu = []     
 
+            # Models of the kernel list by group; created when a group is shown (see get_kernel_model)
+            self.kernel_models = {}
+
+            # Disk space used by the installed kernels (see kittykecore.get_kernel_footprints)
+            self.footprints = {}
+
             # Do an initial refresh       
             self.init_refresh()
 
@@ -119,6 +140,9 @@ class KittykeMainWindow():
 
     # Initial refresh after startup
     def init_refresh(self):
+        # The running kernel booted fine (see kittykecore.get_autoclean_kernels)
+        kittykecore.record_known_good_kernel()
+
         # Do the actual refresh
         self.do_refresh()
 
@@ -180,6 +204,63 @@ class KittykeMainWindow():
     def group_separator_func(self, model, iter, data):
         return model[iter][2] == "separator"
 
+    # Creates the markup of a group row; group is an entry of kittykecore.get_kernel_groups
+    def get_group_markup(self, group):
+        # First, create the string for this top-level node
+        node_markup = ["<span foreground='%s'>%s</span>" % (self.config['Colors']['active'], "<b>"+group['version_major']+"</b>") if group['active'] else group['version_major']][0]
+        node_markup += " (<span foreground='%s'>%d</span>" % (self.config['Colors']['downloaded'], group['downloaded'])
+        node_markup += ", <span foreground='%s'>%d</span>" % (self.config['Colors']['installed'], group['installed'])
+        node_markup += ", %d)" % (group['available'])
+
+        # Second, create a string for the 'info'-column for the number of supported month
+        supporttext = '---'
+        entry = group['support']
+
+        if entry is not None:
+            if entry['month'] > 0:
+                supporttext = "<span foreground='%s'>supported for another %.0d month(s)</span>" % (self.config['Colors']['supported'], entry['month'])
+            elif entry['month'] < 0:
+                supporttext = "<span foreground='%s'>support expired %.0d month(s) ago</span>" % (self.config['Colors']['expired'], entry['month']*-1)
+            else:
+                supporttext = "<span foreground='%s'>support will expire this month</span>" % (self.config['Colors']['toexpire'])  
+
+        #if len(supporttext) > 0:
+        node_markup += "\n" + supporttext
+
+        return node_markup
+
+    # Creates the markup of the "All installed kernels"-group
+    def get_installed_group_markup(self, groups):
+        num_installed = sum([group['installed'] for group in groups])
+
+        return "Show installed kernels\n<span foreground='%s'>%d</span> kernels installed in total" % (self.config['Colors']['installed'], num_installed)
+
+    # Returns an icon of the theme (or of an image file, if the name is a path) in the given size; each icon is
+    # only loaded once and then kept until the theme changes
+    def get_icon(self, name, size):
+        if (name, size) not in self.icons:
+            if name.startswith('/'):
+                self.icons[(name, size)] = GdkPixbuf.Pixbuf.new_from_file_at_scale(name, size, size, True)
+            else:
+                self.icons[(name, size)] = self.theme.load_icon(name, size, 0)
+
+        return self.icons[(name, size)]
+
+    # Called when the icon theme changes; loads the icons again and puts them into the lists
+    def on_theme_changed(self, theme):
+        self.icons = {}
+
+        # Groups: the Ubuntu mainline group has its own icon, separators have none
+        if self.kernelgroup.get_model() is not None:
+            for row in self.kernelgroup.get_model():
+                if row[Group_columns.KITTYKE_GROUP_VERSION.value] == 'ubuntu mainline':
+                    row[Group_columns.KITTYKE_GROUP_ICON.value] = self.get_icon("/usr/lib/kittykernel/ubuntu.svg", 22)
+                elif row[Group_columns.KITTYKE_GROUP_VERSION.value] != 'separator':
+                    row[Group_columns.KITTYKE_GROUP_ICON.value] = self.get_icon("gtk-execute", 22)
+
+        # Kernels: the rows with icons differ now, so they are updated
+        self.update_kernel_models(list(self.kernel_models.keys()))
+
     # Fill treeview (for example after a refresh)   
     def fill_group_list(self):
         try:
@@ -190,66 +271,19 @@ class KittykeMainWindow():
             # Setup a new model for the groups
             model_groups = Gtk.ListStore(GdkPixbuf.Pixbuf, str, str)
 
-            # Add kernel groups
-            for kernel in self.kernels:
-                # Check if there is already a group with the same name and continue if so
-                group_present = False
-
-                for row in model_groups:
-                    if row[Group_columns.KITTYKE_GROUP_VERSION.value] == kernel['version_major']:
-                        group_present = True
-                        break
-
-                if group_present == True:
-                    continue
-
-                # No parent, then add a new one with this major version and a cog symbol
-                num_available = [1 if x['version_major'] == kernel['version_major'] else 0 for x in self.kernels].count(1)
-                num_downloaded = [1 if x['downloaded'] and x['version_major'] == kernel['version_major'] else 0 for x in self.kernels].count(1)
-                num_installed = [1 if x['installed'] and x['version_major'] == kernel['version_major'] else 0 for x in self.kernels].count(1)                    
-
-                # Second, is the active kernel in the current list?
-                has_active_kernel = ([1 if x['active'] and x['version_major'] == kernel['version_major'] else 0 for x in self.kernels].count(1) > 0)                    
-
-                # Third, create the string for this top-level node
-                node_markup = ["<span foreground='%s'>%s</span>" % (self.config['Colors']['active'], "<b>"+kernel['version_major']+"</b>") if has_active_kernel else kernel['version_major']][0]
-                node_markup += " (<span foreground='%s'>%d</span>" % (self.config['Colors']['downloaded'], num_downloaded)
-                node_markup += ", <span foreground='%s'>%d</span>" % (self.config['Colors']['installed'], num_installed)
-                node_markup += ", %d)" % (num_available)
-
-                # Fourth, create a string for the 'info'-column for the number of supported month
-                supporttext = '---'
-                for entry in self.support_times:
-                    if (kernel['origins'].find(entry['origin']+' ') != -1) and (kernel['version_major'] == entry['version']):
-                        if entry['month'] > 0:
-                            supporttext = "<span foreground='%s'>supported for another %.0d month(s)</span>" % (self.config['Colors']['supported'], entry['month'])
-                        elif entry['month'] < 0:
-                            supporttext = "<span foreground='%s'>support expired %.0d month(s) ago</span>" % (self.config['Colors']['expired'], entry['month']*-1)
-                        else:
-                            supporttext = "<span foreground='%s'>support will expire this month</span>" % (self.config['Colors']['toexpire'])  
-
-                #if len(supporttext) > 0:
-                node_markup += "\n" + supporttext
+            # Add kernel groups; they are already sorted by descending version numbers
+            groups = kittykecore.get_kernel_groups(self.kernels, self.support_times)
 
-                # We want to sort the listbox by descending version numbers, so find the first iter, which is smaller than the current version
-                iternextrow = None
-                for row in model_groups:
-                    if kittykecore.compare_versions(kernel['version_major'], row[2]) > 0:
-                        iternextrow = row.iter
-                        break
-
-                # Add to model
-                model_groups.insert_before(iternextrow, [self.theme.load_icon("gtk-execute", 22, 0), node_markup, kernel['version_major']])
+            for group in groups:
+                model_groups.append([self.get_icon("gtk-execute", 22), self.get_group_markup(group), group['version_major']])
 
             # Add empty line and "All installed kernels"-group
-            num_installed = [1 if x['installed'] else 0 for x in self.kernels].count(1)  
             model_groups.append([None, "", "separator"])
-            model_groups.append([self.theme.load_icon("gtk-execute", 22, 0), 
-                    "Show installed kernels\n<span foreground='%s'>%d</span> kernels installed in total" % (self.config['Colors']['installed'], num_installed), "kernels_installed"])
+            model_groups.append([self.get_icon("gtk-execute", 22), self.get_installed_group_markup(groups), "kernels_installed"])
 
             # Add empty line and Ubuntu main line kernels            
             model_groups.append([None, "", "separator"])
-            model_groups.append([GdkPixbuf.Pixbuf.new_from_file_at_scale("/usr/lib/kittykernel/ubuntu.svg", 22, 22, True), 
+            model_groups.append([self.get_icon("/usr/lib/kittykernel/ubuntu.svg", 22), 
                     "Ubuntu mainline kernels archive\nhttp://kernel.ubuntu.com", "ubuntu mainline"])
 
             # Set model to show
@@ -276,78 +310,122 @@ class KittykeMainWindow():
 
         return not group_name[0].isnumeric()
 
-    # Fill in the list of regular kernels (repo)
-    def fill_kernel_list_repo(self, selected_major):
-        # Unset current model, if set; this will empty the list
-        self.kerneltree.set_model(None)
+    # Creates the row of a regular kernel (repo) for the kernel list; index is the index in self.kernels
+    def get_kernel_row(self, index):
+        kernel = self.kernels[index]
 
-        # Setup a new model: Icon, Major version, Icon (installed), Info, Download Size, Installed Size, Origins, Data index
-        model_kernels = Gtk.ListStore(GdkPixbuf.Pixbuf, str, GdkPixbuf.Pixbuf, str, str, str, str, str, int) 
+        # Show a symbol if the kernel is installed (checkmark)
+        pixbufinstalled = [self.get_icon("gtk-yes", 22) if kernel.installed else None][0]
 
-        # Add kernels to model
-        for index, kernel in enumerate(self.kernels):
-            # Should be the major version given OR the kernel should be installed if the respective special group is selected
-            if not (kernel['version_major'] == selected_major or (selected_major == 'kernels_installed' and kernel['installed'])):                
-                continue
+        # Prepare extra info for title
+        titleadds = []
 
-            # Show a symbol if the kernel is installed (checkmark)
-            pixbufinstalled = [self.theme.load_icon("gtk-yes", 22, 0) if kernel["installed"] else None][0]
+        if kernel.active:
+            titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['active'], "active"))
 
-            # Prepare extra info for title
-            titleadds = []
+        if kernel.installed:
+            titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['installed'], "installed"))
 
-            if kernel['active']:
-                titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['active'], "active"))
+        if kernel.downloaded:
+            titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['downloaded'], "downloaded"))
 
-            if kernel['installed']:
-                titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['installed'], "installed"))
+        # Prepare title (package + extra info)
+        title = kernel.package + "\n" + ", ".join(titleadds)
 
-            if kernel['downloaded']:
-                titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['downloaded'], "downloaded"))
+        # Installed kernels: the space they really occupy on disk, in /boot and elsewhere (see kittykecore.get_kernel_footprint)
+        installed_size = kittykecore.sizeof_fmt(kernel.installed_size)
 
-            # Prepare title (package + extra info)
-            title = kernel['package'] + "\n" + ", ".join(titleadds)
+        if kernel.package in self.footprints:
+            footprint = self.footprints[kernel.package]
+            installed_size = "%s\n<small>/boot: %s, other: %s</small>" % (kittykecore.sizeof_fmt(footprint['boot'] + footprint['other']),
+                                                                      kittykecore.sizeof_fmt(footprint['boot']), kittykecore.sizeof_fmt(footprint['other']))
 
-            # Add row to model
-            iterindex = model_kernels.append([None, "", pixbufinstalled, kernel['version'], title, 
-                                     kittykecore.sizeof_fmt(kernel['size']), kittykecore.sizeof_fmt(kernel['installed_size']), kernel['origins'], int(index)])        
+        return [None, "", pixbufinstalled, kernel.version, title, 
+                kittykecore.sizeof_fmt(kernel.size), installed_size, kernel.origins, int(index)]
 
-        # Set the treeview model to show the new list
-        self.kerneltree.set_model(model_kernels)
+    # Creates the row of an Ubuntu kernel for the kernel list; index is the index in self.kernels_ubuntu
+    def get_ubuntu_kernel_row(self, index):
+        kernel = self.kernels_ubuntu[index]
 
-        # Delete model
-        del model_kernels
+        # Prepare extra info for title
+        titleadds = []
 
-    # Fill in the list of Ubuntu kernels
-    def fill_kernel_list_ubuntu(self):
-        # Unset current model, if set; this will empty the list
-        self.kerneltree.set_model(None)
+        if kernel.downloaded_files == len(kernel.files):
+            titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['installed'], "downloaded"))
 
-        # Setup a new model: Icon, Major version, Icon (installed), Info, Download Size, Installed Size, Origins, Data index
-        model_kernels = Gtk.ListStore(GdkPixbuf.Pixbuf, str, GdkPixbuf.Pixbuf, str, str, str, str, str, int) 
+        if kernel.downloaded_files > 0 and kernel.downloaded_files < len(kernel.files):
+            titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['downloaded'], "partly downloaded"))
 
-        # Add kernels to model
-        for index, kernel in enumerate(self.kernels_ubuntu):  
-            # Prepare extra info for title
-            titleadds = []
+        # Prepare title (package + extra info)
+        title = kernel.package + "\n" + ", ".join(titleadds)
 
-            if kernel['downloaded_files'] == len(kernel['files']):
-                titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['installed'], "downloaded"))
+        return [None, "", None, kernel.version, title, kittykecore.sizeof_fmt(kernel.size), "", kernel.url, int(index)]
 
-            if kernel['downloaded_files'] > 0 and kernel['downloaded_files'] < len(kernel['files']):
-                titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['downloaded'], "partly downloaded"))
+    # Creates all rows of a group for the kernel list; the rows are sorted by their data index
+    def get_kernel_rows(self, selected_major):
+        if selected_major == 'ubuntu mainline':
+            return [self.get_ubuntu_kernel_row(index) for index in range(len(self.kernels_ubuntu))]
 
-            # Prepare title (package + extra info)
-            title = kernel['package'] + "\n" + ", ".join(titleadds)
+        # Should be the major version given OR the kernel should be installed if the respective special group is selected
+        return [self.get_kernel_row(index) for index, kernel in enumerate(self.kernels) 
+                if kernel.version_major == selected_major or (selected_major == 'kernels_installed' and kernel.installed)]
 
-            # Add row to model
-            iterindex = model_kernels.append([None, "", None, kernel['version'], title, kittykecore.sizeof_fmt(kernel['size']), "", kernel['url'], int(index)])        
+    # Returns the model of a group for the kernel list; the model is only created the first time the group is
+    # shown after a refresh, then it is kept (see update_kernel_models)
+    def get_kernel_model(self, selected_major):
+        if selected_major not in self.kernel_models:
+            # Setup a new model: Icon, Major version, Icon (installed), Info, Download Size, Installed Size, Origins, Data index
+            model_kernels = Gtk.ListStore(GdkPixbuf.Pixbuf, str, GdkPixbuf.Pixbuf, str, str, str, str, str, int) 
 
-        # Set the treeview model to show the new list
-        self.kerneltree.set_model(model_kernels)
+            # Add kernels to model
+            for row in self.get_kernel_rows(selected_major):
+                model_kernels.append(row)
 
-        # Delete model
-        del model_kernels
+            self.kernel_models[selected_major] = model_kernels
+
+        return self.kernel_models[selected_major]
+
+    # Brings a model up to date with a new list of rows; both have to be sorted by their data index. Rows, which
+    # are not in the list anymore, are removed, new rows are inserted, and only changed rows are set again.
+    def update_model_rows(self, model, rows):
+        data_index = Columns.KITTYKE_DATA_INDEX.value
+
+        treeiter = model.get_iter_first()
+
+        for row in rows:
+            # Remove rows before this one, which are not in the list anymore
+            while treeiter is not None and model[treeiter][data_index] < row[data_index]:
+                if not model.remove(treeiter):
+                    treeiter = None
+
+            # Same row? Then only update it if something changed; otherwise it is a new row
+            if treeiter is not None and model[treeiter][data_index] == row[data_index]:
+                if list(model[treeiter]) != row:
+                    model.set_row(treeiter, row)
+                treeiter = model.iter_next(treeiter)
+            else:
+                model.insert_before(treeiter, row)
+
+        # Remove all remaining rows
+        while treeiter is not None:
+            if not model.remove(treeiter):
+                treeiter = None
+
+    # Updates the models of the given groups, which were already created
+    def update_kernel_models(self, majors):
+        for major in majors:
+            if major in self.kernel_models:
+                self.update_model_rows(self.kernel_models[major], self.get_kernel_rows(major))
+
+    # Fill in the list of regular kernels (repo)
+    def fill_kernel_list_repo(self, selected_major):
+        # Set the treeview model to show the list
+        self.kerneltree.set_model(self.get_kernel_model(selected_major))
+
+    # Fill in the list of Ubuntu kernels
+    def fill_kernel_list_ubuntu(self):
+        # Set the treeview model to show the list
+        self.kerneltree.set_model(self.get_kernel_model('ubuntu mainline'))
 
     # Get selected major version
     def get_kernel_major_selected(self):
@@ -361,6 +439,10 @@ class KittykeMainWindow():
 
     # Fill in the list of kernels based on the major version selected
     def fill_kernel_list(self, selected_major):
+        # CHANGES files still loading in the background should not be shown anymore
+        self.changes_kernel = None
+        self.changelog_major = None
+
         if selected_major == 'ubuntu mainline':
             # Fill kernel list with Ubuntu mainline kernels
             self.fill_kernel_list_ubuntu()
@@ -380,7 +462,7 @@ class KittykeMainWindow():
 
             # Check if we have a changelog for this kernel group
             if selected_major in self.changelogs:
-                self.changelogview.get_buffer().set_text(self.changelogs[selected_major])
+                self.show_changelog(selected_major)
             elif selected_major == 'kernels_installed':
                 self.changelogview.get_buffer().set_text( _("This group shows all installed kernels on your system in one convenient list.") )
             else:
@@ -420,19 +502,14 @@ class KittykeMainWindow():
         # Size of /boot
         sizeofboot = kittykecore.sizeof_boot()
 
-        # Size of all kernels, downloaded and installed
-        sizeofkernels = 0
-
-        for kernel in self.kernels:
-            if kernel['installed']:
-                sizeofkernels += kernel['installed_size']
-            elif kernel['downloaded']:
-                sizeofkernels += kernel['size']
+        # Size of all installed kernels on disk and the part of it in /boot (including initrd images)
+        sizeofkernels = sum([footprint['boot'] + footprint['other'] for footprint in self.footprints.values()])
+        sizeofkernelsboot = sum([footprint['boot'] for footprint in self.footprints.values()])
 
         # Construct the text
         self.builder.get_object("current_kernel").set_label( _("Current kernel version: <b>%s</b>. ") % (kittykecore.get_current_kernel()) \
                                                            + _("/boot: <b>%s</b> of %s free. ") % (kittykecore.sizeof_fmt(sizeofboot[0]), kittykecore.sizeof_fmt(sizeofboot[1])) \
-                                                           + _("Kernels occupy <b>%s</b> of space.") % (kittykecore.sizeof_fmt(sizeofkernels)) )
+                                                           + _("Kernels occupy <b>%s</b> of space (<b>%s</b> in /boot).") % (kittykecore.sizeof_fmt(sizeofkernels), kittykecore.sizeof_fmt(sizeofkernelsboot)) )
 
     # Closes the window and exits kittykernel
     def close_window(self, window, event):
@@ -494,55 +571,66 @@ class KittykeMainWindow():
         # It is important NOT to destroy this dialog if we want to show it again
         prefdialog.hide()   
 
+    # Runs a worker (see kittykethreads) and waits until it is finished; the main loop keeps running in the meantime,
+    # but sleeps until the worker reports progress or is finished. 'progress' is called with the worker (in the
+    # main thread) each time the worker reports progress.
+    def run_worker(self, worker, progress = None):
+        loop = GLib.MainLoop()
+        state = {'finished': False}
+
+        # Both functions are called in the main thread (by GLib.idle_add); return False, so they are only called once
+        def on_progress(worker):
+            if not state['finished'] and progress is not None:
+                progress(worker)
+            return False
+
+        def on_finished(worker):
+            state['finished'] = True
+            loop.quit()
+            return False
+
+        worker.on_progress = lambda worker: GLib.idle_add(on_progress, worker)
+        worker.on_finished = lambda worker: GLib.idle_add(on_finished, worker)
+
+        worker.start()
+        loop.run()
+
     # Do a refresh without cache-update
     def do_refresh(self):      
+        # /boot could have changed outside of kittykernel (e.g. apt autoremove in a terminal)
+        kittykecore.invalidate_sizeof_boot()
+
         # Prepare progress window
         dlg = kittykeprogress.KittyKeProgressDialog(self.window, "KittyKernel updates kernel information", False)
         dlg.update(0.0, "Loading repository information...")
 
-        # Prepare task list   
-        tasks = [   ("Loading ~/.config/kittykernel/blacklist", kittykethreads.Worker_Load_Blacklist),
-                    ("Loading /usr/lib/kittykernel/kernel_support", kittykethreads.Worker_Load_Supporttimes),
-                    ("Loading kernel information from repository", kittykethreads.Worker_Load_Kernels),
-                    ("Downloading changelogs", kittykethreads.Worker_Load_Changelogs),
-                    ("Loading Ubuntu mainline kernel information from\nhttp://kernel.ubuntu.com/~kernel-ppa/mainline/", kittykethreads.Worker_Load_Ubuntu_Kernels) ]
+        # Prepare task list: name, description, worker, dependencies (names of other tasks), attribute with the result
+        tasks = [   ("blacklist", "Loading ~/.config/kittykernel/blacklist", kittykethreads.Worker_Load_Blacklist, [], "blacklist"),
+                    ("support_times", "Loading /usr/lib/kittykernel/kernel_support", kittykethreads.Worker_Load_Supporttimes, [], "support_times"),
+                    ("kernels", "Loading kernel information from repository", kittykethreads.Worker_Load_Kernels, ["blacklist"], "kernels"),
+                    ("changelogs", "Downloading changelogs", kittykethreads.Worker_Load_Changelogs, ["kernels"], "changelogs"),
+                    ("footprints", "Determining the disk space used by kernels", kittykethreads.Worker_Load_Footprints, ["kernels"], "footprints"),
+                    ("kernels_ubuntu", "Loading Ubuntu mainline kernel information from\nhttp://kernel.ubuntu.com/~kernel-ppa/mainline/", 
+                                       kittykethreads.Worker_Load_Ubuntu_Kernels, ["blacklist"], "kernels_ubuntu") ]
 
         # Prepare cache and clean treeviews
         kittykecore.reopen_cache() 
         self.kerneltree.set_model(None)      
         self.kernelgroup.set_model(None)
+        self.kernel_models = {}
 
-        # Run each task in a thread
-        for index, task in enumerate(tasks):
-            # Update the progressbar fraction and text
-            dlg.update(index/len(tasks), task[0])
-            
-            # Prepare thread
-            if index in [2, 4]:
-                thread = task[1](self.blacklist)
-            elif index == 3:
-                thread = task[1](self.kernels)
-            else:
-                thread = task[1]()
-
-            # And start it
-            thread.start()                   
-            
-            # Until the thread is finished, process input (mainly for the dialog)
-            while thread.is_alive():
-                while Gtk.events_pending(): Gtk.main_iteration_do(False)
-
-            # Gather information from threads
-            if index == 0:
-                self.blacklist = thread.blacklist
-            elif index == 1:
-                self.support_times = thread.support_times
-            elif index == 2:
-                self.kernels = thread.kernels
-            elif index == 3:
-                self.changelogs = thread.changelogs
-            elif index == 4:
-                self.kernels_ubuntu = thread.kernels_ubuntu
+        # Run the tasks; independent tasks run at the same time
+        thread = kittykethreads.Worker_Task_Graph(tasks)
+
+        self.run_worker(thread, lambda thread: dlg.update(thread.get_progress(), "\n".join(thread.get_running_descriptions())))
+
+        # Gather information from tasks
+        self.blacklist = thread.results["blacklist"]
+        self.support_times = thread.results["support_times"]
+        self.kernels = thread.results["kernels"]
+        self.changelogs = thread.results["changelogs"]
+        self.footprints = thread.results["footprints"]
+        self.kernels_ubuntu = thread.results["kernels_ubuntu"]
 
         # Clean up
         dlg.update(1.0, "Finished.")
@@ -555,6 +643,85 @@ class KittykeMainWindow():
 
         return      
 
+    # Installs, removes, or purges kernels in one transaction showing a progress window; the kernels are updated
+    # afterwards (see do_refresh_kernels). Nothing is done if the plan of the transaction does not fit.
+    def perform_kernels(self, packages, verb):
+        # Plan first; plans, which would fill up /boot (or cannot be done at all), are refused
+        plan = kittykecore.plan_kernels(packages, verb)
+
+        if plan is not None and not plan['fits']:
+            dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.CLOSE, _("Kernel packages cannot be modified"))
+            dialog.format_secondary_text(kittykecore.get_plan_summary(plan) + "\n\n" + _("Please remove kernels you don't need anymore. It is suggested to keep the last working kernel."))
+            dialog.run()
+            dialog.destroy()
+            return
+
+        # Show the plan (e.g. packages removed as well and the size of the download) before anything is done
+        dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.QUESTION, Gtk.ButtonsType.OK_CANCEL, _("Modify kernel packages?"))
+        dialog.format_secondary_text([kittykecore.get_plan_summary(plan) if plan is not None else _("The changes could not be determined in advance.")][0])
+
+        response = dialog.run()
+        dialog.destroy()
+
+        if response != Gtk.ResponseType.OK:
+            return
+
+        # Prepare progress window
+        dlg = kittykeprogress.KittyKeProgressDialog(self.window, "KittyKernel modifies kernel packages", False)
+        dlg.update(0.0, _("Modifying kernel packages. Please wait, this can take some time.") + ["\n\n" + kittykecore.get_plan_summary(plan) if plan is not None else ""][0])
+
+        # Run the transaction and show its progress
+        thread = kittykethreads.Worker_Perform_Kernels(packages, verb, self.window.get_window().get_xid())
+
+        self.run_worker(thread, lambda thread: dlg.update(min(1.0, max(0.0, thread.progress)), thread.status))
+
+        # Clean up
+        dlg.update(1.0, "Finished.")
+        dlg.destroy()
+        del dlg
+
+        # Something went wrong? Tell the user
+        if thread.result != 0:
+            dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.WARNING, Gtk.ButtonsType.CLOSE, _("Modifying kernel packages failed"))
+            dialog.format_secondary_text( _("The kernel packages could not be modified (error code %d).") % thread.result + "".join(["\n\n" + error for error in thread.errors]))
+            dialog.run()
+            dialog.destroy()
+
+        self.do_refresh_kernels(packages)
+
+    # Updates only the given kernel packages (e.g. after installing or removing them) instead of a full refresh; the
+    # rows of these kernels and their groups are updated in place
+    def do_refresh_kernels(self, packages):
+        # Reread the kernels from the cache
+        updated = kittykecore.update_kernels(self.kernels, packages)
+
+        majors = set([self.kernels[index].version_major for index in updated])
+
+        groups = kittykecore.get_kernel_groups(self.kernels, self.support_times)
+        groups_by_major = {group['version_major']: group for group in groups}
+
+        # Update the groups of these kernels and the "All installed kernels"-group
+        for row in self.kernelgroup.get_model():
+            if row[Group_columns.KITTYKE_GROUP_VERSION.value] in majors:
+                row[Group_columns.KITTYKE_GROUP_NAME.value] = self.get_group_markup(groups_by_major[row[Group_columns.KITTYKE_GROUP_VERSION.value]])
+            elif row[Group_columns.KITTYKE_GROUP_VERSION.value] == 'kernels_installed':
+                row[Group_columns.KITTYKE_GROUP_NAME.value] = self.get_installed_group_markup(groups)
+
+        # Only the footprints of the kernels, which changed, are determined again
+        self.footprints = kittykecore.get_kernel_footprints(self.kernels)
+
+        # Update the kernel lists of these groups; kernels could be added or removed from the "All installed kernels"-group
+        self.update_kernel_models(majors | set(['kernels_installed']))
+
+        self.update_infobar()
+
+    # Updates only the downloaded files of an Ubuntu kernel (e.g. after downloading or removing them) instead of a
+    # full refresh; index is the index in self.kernels_ubuntu
+    def do_refresh_ubuntu_kernel(self, index):
+        self.kernels_ubuntu[index].downloaded_files = kittykecore.ubuntu_kernel_downloaded_files(self.kernels_ubuntu[index])
+
+        self.update_kernel_models(['ubuntu mainline'])
+
     # Refreshes the cache
     def on_refresh(self, widget):    
         self.do_refresh()
@@ -638,7 +805,7 @@ class KittykeMainWindow():
 
             # Is it in kernels?            
             if 0 <= index < len(self.kernels):
-                if self.kernels[index]['active']:
+                if self.kernels[index].active:
                     return treeiter
 
             # Next element
@@ -692,7 +859,19 @@ class KittykeMainWindow():
         if selected_major == 'ubuntu mainline':
             # Is it a kernel?
             if 0 <= index < len(self.kernels_ubuntu):
-                self.changelogview.get_buffer().set_text(self.kernels_ubuntu[index]['url'] + "CHANGES\n\n" + self.kernels_ubuntu[index]['changes'])        
+                self.changes_kernel = self.kernels_ubuntu[index]
+
+                # Loaded recently? Then show immediately; otherwise load in the background
+                changes = kittykecore.get_cached_ubuntu_kernel_changes(self.changes_kernel)
+
+                if changes is not None:
+                    self.show_ubuntu_changes(self.changes_kernel, changes)
+                else:
+                    self.changelogview.get_buffer().set_text(self.changes_kernel.url + "CHANGES\n\n" + _("Loading, please wait..."))
+
+                    thread = kittykethreads.Worker_Load_Ubuntu_Changes(self.changes_kernel)
+                    thread.on_finished = lambda thread, kernel = self.changes_kernel: GLib.idle_add(self.show_ubuntu_changes, kernel, thread.changes)
+                    thread.start()
 
         # Repo-kernels
         elif not self.is_special_kernel_group(selected_major) or selected_major == 'kernels_installed':
@@ -702,35 +881,78 @@ class KittykeMainWindow():
 
             # For special groups such as "all installed kernels" we have to load actually the right changelog first
             if selected_major == 'kernels_installed':
-                if self.kernels[index]['version_major'] in self.changelogs:
-                    self.changelogview.get_buffer().set_text(self.changelogs[self.kernels[index]['version_major']])
+                if self.kernels[index].version_major in self.changelogs and self.kernels[index].version_major != self.changelog_major:
+                    self.show_changelog(self.kernels[index].version_major)
+
+            # Is it a kernel with a changelog? Then look up its section (see ChangelogStore.find_section)
+            if 0 <= index < len(self.kernels) and self.kernels[index].version_major in self.changelogs:
+                section = self.changelogs.find_section(self.kernels[index].version_major, self.kernels[index].pkg_version)
+
+                # Found? Then load the changelog up to this section, select the version, and scroll to line
+                if section is not None:
+                    buffer = self.changelogview.get_buffer()
+
+                    while buffer.get_char_count() <= section[1] + len(section[0]) + 2 and self.load_more_changelog():
+                        pass
+
+                    match_start = buffer.get_iter_at_offset(section[1])
+                    match_end = buffer.get_iter_at_offset(section[1] + len(section[0]) + 2)
+                    buffer.select_range(match_start, match_end)
+                    self.changelogview.scroll_to_iter(match_start, 0.0, True, 0.5, 0.5)
+
+    # Shows the changelog of a major version; only the first sections are loaded, the others are appended when
+    # the user scrolls down (see on_changelog_scrolled). The text buffer always contains the beginning of the log,
+    # so the offsets of the section index can be used for the buffer.
+    def show_changelog(self, major):
+        self.changelog_major = major
+        self.changelog_loaded = 0
+
+        self.changelogview.get_buffer().set_text("")
+
+        # No sections at all (e.g. some weird format)? Then show the whole log
+        if len(self.changelogs.get_sections(major)) == 0:
+            self.changelogview.get_buffer().set_text(self.changelogs[major])
+            self.changelog_major = None
+            return
 
-            # Is it a kernel?
-            if 0 <= index < len(self.kernels):
-                # Selected kernel version; remove iterative parts separated by ~ until a package is found, i.e.
-                # it will look for "(4.10.0-28.32~16.04.2", then for "4.10.0-28.32", and then for "(4.10"
-                searchlist = self.kernels[index]['pkg_version'].split('~')
+        self.load_more_changelog()
 
-                # Add an extra index for 'worst'-case: look for major version
-                for n in range(len(searchlist)+1):
-                    searchstr = "~".join(searchlist[:len(searchlist)-n])
+    # Appends the next sections of the changelog shown; returns False if there is nothing more to load
+    def load_more_changelog(self):
+        if self.changelog_major is None:
+            return False
+
+        count = len(self.changelogs.get_sections(self.changelog_major))
 
-                    # Slice empty? Then use major version
-                    if searchstr == "":
-                        searchstr = self.kernels[index]['version_major']
+        if self.changelog_loaded >= count:
+            return False
 
-                    # Add bracket to find sections instead of just every string
-                    searchstr = "(" + searchstr
+        last = min(count, self.changelog_loaded + changelog_sections_per_load)
 
-                    # Find first entry, backwards
-                    found = self.changelogview.get_buffer().get_start_iter().forward_search(searchstr, 0, None) 
+        buffer = self.changelogview.get_buffer()
+        buffer.insert(buffer.get_end_iter(), self.changelogs.read_sections(self.changelog_major, self.changelog_loaded, last))
 
-                    # Found? Then select and scroll to line
-                    if found:
-                        match_start, match_end = found
-                        self.changelogview.get_buffer().select_range(match_start, match_end)
-                        self.changelogview.scroll_to_iter(match_start, 0.0, True, 0.5, 0.5)
-                        break
+        self.changelog_loaded = last
+
+        return True
+
+    # Called each time the changelog is scrolled; loads more sections when the user gets close to the end
+    def on_changelog_scrolled(self, adjustment):
+        if adjustment.get_value() + 2 * adjustment.get_page_size() >= adjustment.get_upper():
+            self.load_more_changelog()
+
+    # Shows the CHANGES file of an Ubuntu kernel; ignored if the user selected another kernel in the meantime
+    def show_ubuntu_changes(self, kernel, changes):
+        if kernel is not self.changes_kernel:
+            return False
+
+        if len(changes) == 0:
+            changes = _("No CHANGES file available for this kernel. Sorry.")
+
+        self.changelogview.get_buffer().set_text(kernel.url + "CHANGES\n\n" + changes)
+
+        # Only run once when called from idle_add
+        return False
 
     # Check for mouse buttons in kernel list
     def on_tree_button_press(self, widget, event):
@@ -767,7 +989,7 @@ class KittykeMainWindow():
             menu = self.builder.get_object("menu_kernel")
 
             # This is a special case, when the selected item is the current kernel
-            if self.kernels[index]['active']:
+            if self.kernels[index].active:
                 menu = Gtk.Menu()
                 menuItem = Gtk.MenuItem.new_with_label(_("This is the current kernel. Look but do not touch!")) 
                 menuItem.set_sensitive(False)      
@@ -796,39 +1018,36 @@ class KittykeMainWindow():
             menu.show_all()
             menu.popup(None, None, None, None, event.button, event.time)
 
-    # Download an Ubuntu kernel showing a progress window (in future this could do file by file)
+    # Download an Ubuntu kernel showing a progress window; all files are downloaded at the same time
     def download_ubuntu_kernel(self, kernel, redownload = False):
         # Prepare progress window
         dlg = kittykeprogress.KittyKeProgressDialog(self.window, "KittyKernel downloads files", False)
-        dlg.update(0.0, "Download kernel package files from\n" + kernel['url'])
+        dlg.update(0.0, "Download kernel package files from\n" + kernel.url)
 
         size_of_files = 0
-        size_downloaded = 0
 
-        for file in kernel['files']:
-            size_of_files += file[2]
+        for file in kernel.files:
+            size_of_files += file.size
 
-        # Start download
-        for index, file in enumerate(kernel['files']):         
-            thread = kittykethreads.Worker_Load_Download_Ubuntu_Kernel(kernel, index, redownload)
-            thread.start()                   
-        
-            # Until the thread is finished, process input (mainly for the dialog)
-            while thread.is_alive():
-                # Check file size and update
-                size_file = kittykecore.get_ubuntu_kernel_file_size(kernel, index)
-                dlg.update(float(size_downloaded + size_file)/float(size_of_files), "Download kernel package files from\n" + kernel['url'] + "\n\n" 
-                                                            + file[0] + " (" + kittykecore.sizeof_fmt(file[2]) + ")" )
-                # Work on
-                while Gtk.events_pending(): Gtk.main_iteration_do(False)
+        # Start download and update the dialog with the bytes downloaded so far
+        thread = kittykethreads.Worker_Load_Download_Ubuntu_Kernel(kernel, redownload)
 
-            size_downloaded += kittykecore.get_ubuntu_kernel_file_size(kernel, index)
+        self.run_worker(thread, lambda thread: dlg.update(min(1.0, float(thread.get_bytes_downloaded())/float(max(1, size_of_files))), 
+                                                          "Download kernel package files from\n" + kernel.url + "\n\n" 
+                                                          + "%d file(s) (%s)" % (len(kernel.files), kittykecore.sizeof_fmt(size_of_files)) ))
 
         # Clean up
         dlg.update(1.0, "Finished.")
         dlg.destroy()
         del dlg    
 
+        # Something went wrong? Tell the user; downloads can be resumed
+        if not thread.result:
+            dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.WARNING, Gtk.ButtonsType.CLOSE, _("Download incomplete"))
+            dialog.format_secondary_text( _("Not all files of this kernel could be downloaded. Downloading the kernel again will resume the download."))
+            dialog.run()
+            dialog.destroy()
+
     # Download a kernel - selecting this means to force redownload if files are already there
     def on_kernel_download(self, widget):
         # No kernels in list?
@@ -845,7 +1064,7 @@ class KittykeMainWindow():
             # Ubuntu kernel
             if self.get_kernel_major_selected() == 'ubuntu mainline':   
                 self.download_ubuntu_kernel(self.kernels_ubuntu[index], redownload = True)
-                self.do_refresh()
+                self.do_refresh_ubuntu_kernel(index)
 
     # Installs a kernel
     def on_kernel_install(self, widget):
@@ -864,12 +1083,12 @@ class KittykeMainWindow():
             if self.get_kernel_major_selected() == 'ubuntu mainline':
                 # Download kernel and install it then                
                 self.download_ubuntu_kernel(self.kernels_ubuntu[index])       
-                self.do_refresh()
+                self.do_refresh_ubuntu_kernel(index)
 
             # Repo kernel
             elif not self.is_special_kernel_group(self.get_kernel_major_selected()):
                 # Is this kernel _not_ installed?
-                if not self.kernels[index]['installed']:
+                if not self.kernels[index].installed:
                     # Check free space on /boot
                     freeonboot = kittykecore.sizeof_boot()[0]
 
@@ -886,8 +1105,7 @@ class KittykeMainWindow():
 
                         dialog.destroy()
 
-                    kittykecore.perform_kernels( [self.kernels[index]['package']], 'install', self.window.get_window().get_xid())
-                    self.do_refresh()
+                    self.perform_kernels([self.kernels[index].package], 'install')
 
 
     # Removes a kernel
@@ -905,18 +1123,17 @@ class KittykeMainWindow():
         if self.get_kernel_major_selected() == 'ubuntu mainline':
             # Download kernel and install it then            
             kittykecore.remove_ubuntu_kernel_files(self.kernels_ubuntu[index])
-            self.do_refresh()
+            self.do_refresh_ubuntu_kernel(index)
 
         # Repo kernel
         elif not self.is_special_kernel_group(self.get_kernel_major_selected()):
             # Current kernel? Don't touch!
-            if self.kernels[index]['active']:
+            if self.kernels[index].active:
                 return
 
             # Is this kernel installed?
-            if self.kernels[index]['installed']:
-                kittykecore.perform_kernels( [self.kernels[index]['package']], 'remove', self.window.get_window().get_xid())
-                self.do_refresh()
+            if self.kernels[index].installed:
+                self.perform_kernels([self.kernels[index].package], 'remove')
 
     # Purges a kernel
     def on_kernel_purge(self, widget):
@@ -936,13 +1153,12 @@ class KittykeMainWindow():
             index = model[treeiter][Columns.KITTYKE_DATA_INDEX.value]
 
             # Current kernel? Don't touch!
-            if self.kernels[index]['active']:
+            if self.kernels[index].active:
                 return
 
             # Is this kernel installed?
-            if self.kernels[index]['installed'] or self.kernels[index]['downloaded']:
-                kittykecore.perform_kernels( [self.kernels[index]['package']], 'purge', self.window.get_window().get_xid())
-                self.do_refresh()
+            if self.kernels[index].installed or self.kernels[index].downloaded:
+                self.perform_kernels([self.kernels[index].package], 'purge')
 
     # Purges all kernels except the active one
     def on_kernel_purge_all(self, widget):
@@ -955,12 +1171,12 @@ class KittykeMainWindow():
         # Check each kernel
         for kernel in self.kernels:
             # Is active one? Ignore
-            if kernel['active']:
+            if kernel.active:
                 continue
 
             # Is installed? Then purge!
-            if kernel['installed'] or kernel['downloaded']:
-                kernels_to_purge.append(kernel['package'])
+            if kernel.installed or kernel.downloaded:
+                kernels_to_purge.append(kernel.package)
 
         # No kernels selected? Display a messagebox
         if len(kernels_to_purge) == 0:
@@ -971,8 +1187,7 @@ class KittykeMainWindow():
 
         # Send to purge function and refresh list afterwards
         else:
-            kittykecore.perform_kernels( kernels_to_purge, 'purge', self.window.get_window().get_xid())
-            self.do_refresh()
+            self.perform_kernels(kernels_to_purge, 'purge')
 
     # Removes all kernels from the currently selected group
     def on_remove_group(self, widget):
@@ -998,8 +1213,8 @@ class KittykeMainWindow():
             index = model[treeiter][Columns.KITTYKE_DATA_INDEX.value]
 
             # Kernel should be installed; if yes -> add
-            if self.kernels[index]['installed'] and not self.kernels[index]['active']:
-                kernels_to_remove.append(self.kernels[index]['package'])
+            if self.kernels[index].installed and not self.kernels[index].active:
+                kernels_to_remove.append(self.kernels[index].package)
 
             # Next element
             treeiter = model.iter_next(treeiter)           
@@ -1013,8 +1228,7 @@ class KittykeMainWindow():
 
         # Send to purge function and refresh list afterwards
         else:
-            kittykecore.perform_kernels( kernels_to_remove, 'remove', self.window.get_window().get_xid())
-            self.do_refresh()
+            self.perform_kernels(kernels_to_remove, 'remove')
 
 
     # Purges all kernels from the currently selected group
@@ -1041,8 +1255,8 @@ class KittykeMainWindow():
             index = model[treeiter][Columns.KITTYKE_DATA_INDEX.value]
 
             # Kernel should be installed; if yes -> add
-            if (self.kernels[index]['installed'] or self.kernels[index]['downloaded']) and not self.kernels[index]['active']:
-                kernels_to_purge.append(self.kernels[index]['package'])
+            if (self.kernels[index].installed or self.kernels[index].downloaded) and not self.kernels[index].active:
+                kernels_to_purge.append(self.kernels[index].package)
 
             # Next element
             treeiter = model.iter_next(treeiter)           
@@ -1056,8 +1270,7 @@ class KittykeMainWindow():
 
         # Send to purge function and refresh list afterwards
         else:
-            kittykecore.perform_kernels( kernels_to_purge, 'purge', self.window.get_window().get_xid())
-            self.do_refresh()
+            self.perform_kernels(kernels_to_purge, 'purge')
 
 
 
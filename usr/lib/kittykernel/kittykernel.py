@@ -20,7 +20,8 @@
 #
 #
 #  Entry point for kittykernel; just check  if there is another instance
-#  running. If not, open the main window.
+#  running. If not, open the main window. Commands  (e.g. 'list') are run
+#  without any user interface.
 #
 # 
 #  Warning: Don't read this  source file if  you are annoyed by too many
@@ -39,9 +40,45 @@ parser = argparse.ArgumentParser(prog = "kittykernel", description = "Kittykerne
 
 parser.add_argument("-c", "--console", help = "use console user interface even if X-server is available", action='store_true')
 parser.add_argument("-g", "--gui", help = "use graphical user interface even if X-server is not detected", action='store_true')
+parser.add_argument("--json", help = "print machine-readable output (JSON) for the commands below", action='store_true')
+parser.add_argument("--backend", help = "backend for changing packages (default: from config)", choices = ['auto', 'synaptic', 'apt', 'apt-get'])
+
+# The same options are accepted after the command (e.g. 'kittykernel list --json'); they are suppressed if not given,
+# so they do not overwrite the options given before the command
+common = argparse.ArgumentParser(add_help = False)
+common.add_argument("--json", help = "print machine-readable output (JSON)", action='store_true', default = argparse.SUPPRESS)
+common.add_argument("--backend", help = "backend for changing packages (default: from config)", choices = ['auto', 'synaptic', 'apt', 'apt-get'], default = argparse.SUPPRESS)
+
+# Commands for running kittykernel without user interface (see kittykecli)
+commands = parser.add_subparsers(dest = "command", metavar = "command", help = "run without user interface: list, install, remove, purge, autoclean")
+
+command = commands.add_parser("list", help = "list kernels", parents = [common])
+command.add_argument("--installed", help = "only list installed kernels", action='store_true')
+command.add_argument("--all", help = "list blacklisted kernels as well", action='store_true')
+
+for verb in ['install', 'remove', 'purge']:
+    command = commands.add_parser(verb, help = "%s kernels (with headers and extras)" % verb, parents = [common])
+    command.add_argument("packages", help = "kernel packages, e.g. linux-image-4.15.0-29-generic", nargs = '+')
+    command.add_argument("--no-headers", help = "do not %s the headers" % verb, action='store_true')
+    command.add_argument("--no-extras", help = "do not %s the extra modules" % verb, action='store_true')
+    command.add_argument("--dry-run", help = "only show what would be done", action='store_true')
+    command.add_argument("-y", "--yes", help = "do not ask before removing other packages as well", action='store_true')
+
+command = commands.add_parser("autoclean", help = "purge all kernels except the active one, the newest ones of each flavour, and the last known-good one (see config)", parents = [common])
+command.add_argument("--keep", help = "number of newest kernels to keep per flavour (default: from config)", type = int)
+command.add_argument("--dry-run", help = "only show what would be purged and how much space this frees", action='store_true')
+command.add_argument("-y", "--yes", help = "do not ask before removing other packages as well", action='store_true')
 
 args = vars(parser.parse_args())
 
+# Load the language-definitions (i18n) for kittykernel
+gettext.install("kittykernel", "/usr/share/kittykernel/locale")
+
+# Command given? Then just run it without user interface: no check for other instances and no GTK3 or urwid
+if args["command"] is not None:
+    import kittykecli
+    sys.exit(kittykecli.run(args))
+
 # Check for another instance of kittykernel; if there is one, then just exit this process
 try:
     numKittyKernel = subprocess.check_output("ps -A | grep kittykernel_main_proc | wc -l", shell = True).decode("utf-8").strip()
@@ -55,9 +92,6 @@ except Exception as e:
 # Set the process title to something more descriptive (shown by ps); should be the same as above, so it can be replaced
 setproctitle.setproctitle("kittykernel_main_proc")
 
-# Load the language-definitions (i18n) for kittykernel
-gettext.install("kittykernel", "/usr/share/kittykernel/locale")
-
 # GUI should be used
 use_GUI = False
 
@@ -32,40 +32,75 @@ import kittykecore
 import time
 
 
+# Base class of all workers: 'on_progress' and 'on_finished' can be set to functions, which are called with the
+# worker as argument when the worker reports progress and when it is finished. Both are called from the worker
+# thread, so the GUI has to pass them on to its main loop. Progress is reported at most every progress_interval
+# seconds. Derived workers do their work in 'work' instead of 'run'.
+class Worker(threading.Thread):
+    progress_interval = 0.1
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.on_progress = None
+        self.on_finished = None
+        self._progress_time = 0.0
+
+    # Reports progress (see on_progress); 'force' ignores the progress interval
+    def report_progress(self, force = False):
+        if self.on_progress is None:
+            return
+
+        now = time.monotonic()
+
+        if force or now - self._progress_time >= self.progress_interval:
+            self._progress_time = now
+            self.on_progress(self)
+
+    # The actual work of the worker
+    def work(self):
+        return
+
+    def run(self):
+        try:
+            self.work()
+        finally:
+            if self.on_finished is not None:
+                self.on_finished(self)
+
 # Worker for loading the blacklist from file
-class Worker_Load_Blacklist(threading.Thread):
+class Worker_Load_Blacklist(Worker):
     blacklist = []
 
     def __init__(self): 
-        threading.Thread.__init__(self) 
+        Worker.__init__(self) 
 
-    def run(self):  
+    def work(self):  
         # Get blacklist from file
         self.blacklist = kittykecore.load_blacklist() 
         return
 
 # Worker for loading the support times from file
-class Worker_Load_Supporttimes(threading.Thread):
+class Worker_Load_Supporttimes(Worker):
     support_times = []
 
     def __init__(self): 
-        threading.Thread.__init__(self) 
+        Worker.__init__(self) 
 
-    def run(self):  
+    def work(self):  
         # Get support times from file
         self.support_times = kittykecore.get_kernel_support_times()
         return
 
 # Worker for loading the kernel information from the repo
-class Worker_Load_Kernels(threading.Thread):
+class Worker_Load_Kernels(Worker):
     _blacklist = []
     kernels = []
 
     def __init__(self, blacklist): 
-        threading.Thread.__init__(self) 
+        Worker.__init__(self) 
         self._blacklist = blacklist
 
-    def run(self):  
+    def work(self):  
         # Load kernels
         self.kernels = kittykecore.get_kernels()
 
@@ -74,49 +109,184 @@ class Worker_Load_Kernels(threading.Thread):
         return
 
 # Worker for loading the changelogs from the repos
-class Worker_Load_Changelogs(threading.Thread):
+class Worker_Load_Changelogs(Worker):
     _kernels = []
     changelogs = []
 
     def __init__(self, kernels): 
-        threading.Thread.__init__(self) 
+        Worker.__init__(self) 
         self._kernels = kernels
 
-    def run(self):  
+    def work(self):  
         # Load changelog for every major version        
         self.changelogs = kittykecore.get_kernel_changelogs(self._kernels)
         return
 
+# Worker for determining how much space the installed kernels occupy on disk
+class Worker_Load_Footprints(Worker):
+    _kernels = []
+    footprints = {}
+
+    def __init__(self, kernels):
+        Worker.__init__(self)
+        self._kernels = kernels
+
+    def work(self):
+        # Footprint of every installed kernel
+        self.footprints = kittykecore.get_kernel_footprints(self._kernels)
+        return
+
 # Worker for updating the Ubuntu kernel information from the web
-class Worker_Load_Ubuntu_Kernels(threading.Thread):
+class Worker_Load_Ubuntu_Kernels(Worker):
     _blacklist = []
     kernels_ubuntu = []
+    progress = 0.0
 
     def __init__(self, blacklist): 
-        threading.Thread.__init__(self) 
+        Worker.__init__(self) 
         self._blacklist = blacklist
 
-    def run(self):  
-        self.kernels_ubuntu = kittykecore.get_ubuntu_kernels()
+    # Called by the crawler each time a page of a version was downloaded
+    def update_progress(self, done, total):
+        self.progress = float(done) / float(total)
+        self.report_progress()
+
+    def work(self):  
+        self.kernels_ubuntu = kittykecore.get_ubuntu_kernels(progress = self.update_progress)
         self.kernels_ubuntu = kittykecore.apply_blacklist(self.kernels_ubuntu, self._blacklist)
 
         for index, kernel in enumerate(self.kernels_ubuntu):
-            self.kernels_ubuntu[index]['version_major'] = 'ubuntu mainline'
+            self.kernels_ubuntu[index].version_major = 'ubuntu mainline'
         return
 
-# Worker for downloading a Ubuntu kernel
-class Worker_Load_Download_Ubuntu_Kernel(threading.Thread):
+# Worker for loading the CHANGES file of a Ubuntu kernel
+class Worker_Load_Ubuntu_Changes(Worker):
+    _kernel = []
+    changes = ""
+
+    def __init__(self, kernel):
+        Worker.__init__(self)
+        self.daemon = True
+        self._kernel = kernel
+
+    def work(self):
+        self.changes = kittykecore.get_ubuntu_kernel_changes(self._kernel)
+
+# Worker for downloading all files of a Ubuntu kernel
+class Worker_Load_Download_Ubuntu_Kernel(Worker):
     _kernel = []
-    _index = 0
     _redownload = False
+    bytes_downloaded = {}
+    result = False
 
-    def __init__(self, kernel, index, redownload = False):
-        threading.Thread.__init__(self)
+    def __init__(self, kernel, redownload = False):
+        Worker.__init__(self)
         self._kernel = kernel
-        self._index = index
         self._redownload = redownload
+        self.bytes_downloaded = {}
+
+    # Called by the download engine after each block with the bytes downloaded so far of a file
+    def update_progress(self, index, size):
+        self.bytes_downloaded[index] = size
+        self.report_progress()
+
+    # Number of bytes downloaded (of all files)
+    def get_bytes_downloaded(self):
+        return sum(self.bytes_downloaded.values())
+
+    def work(self):        
+        self.result = kittykecore.download_ubuntu_kernel_files(self._kernel, self._redownload, progress = self.update_progress)
+
+# Worker for installing, removing, or purging kernels in one transaction (see kittykecore.perform_kernels)
+class Worker_Perform_Kernels(Worker):
+    _packages = []
+    _verb = ""
+    _xwindow_id = 0
+    progress = 0.0
+    status = ""
+    result = 0
+    errors = []
+
+    def __init__(self, packages, verb, xwindow_id = 0):
+        Worker.__init__(self)
+        self._packages = packages
+        self._verb = verb
+        self._xwindow_id = xwindow_id
+        self.errors = []
+
+    # Called by the backend with the progress of the transaction and a text describing what is going on
+    def update_progress(self, fraction, status):
+        self.progress = fraction
+        self.status = status
+        self.report_progress()
+
+    def work(self):
+        self.result = kittykecore.perform_kernels(self._packages, self._verb, self._xwindow_id, progress = self.update_progress, errors = self.errors)
+
+# Worker for running several workers (tasks) with dependencies between them; tasks, which do not depend on each
+# other, run at the same time. Each task is a tuple (name, description, worker class, dependencies, result): the
+# worker is created with the results of the dependencies (names of other tasks) as arguments and the attribute
+# 'result' of the worker is the result of the task. All results are saved in 'results' by the name of the task.
+# Progress is reported each time a task reports progress or is finished.
+class Worker_Task_Graph(Worker):
+    _tasks = []
+    _condition = None
+    results = {}
+    finished = []
+    running = {}
+
+    def __init__(self, tasks):
+        Worker.__init__(self)
+        self._tasks = tasks
+        self._condition = threading.Condition()
+        self.results = {}
+        self.finished = []
+        self.running = {}
+
+    # Called (from the thread of the task) when the worker of a task is finished; saves the result
+    def task_finished(self, task, worker):
+        with self._condition:
+            self.results[task[0]] = getattr(worker, task[4], None)
+            self.finished.append(task[0])
+            del self.running[task[0]]
+            self._condition.notify()
+
+        self.report_progress(force = True)
+
+    # Returns the progress as fraction; workers, which report their own progress, count as partly finished
+    def get_progress(self):
+        with self._condition:
+            progress = len(self.finished) + sum([getattr(worker, 'progress', 0.0) for worker in self.running.values()])
+
+        return progress / max(1, len(self._tasks))
+
+    # Returns the descriptions of the tasks running at the moment
+    def get_running_descriptions(self):
+        with self._condition:
+            return [task[1] for task in self._tasks if task[0] in self.running]
+
+    def work(self):
+        pending = list(self._tasks)
+
+        with self._condition:
+            while len(pending) > 0 or len(self.running) > 0:
+                # Start all tasks, for which all dependencies are finished
+                for task in [task for task in pending if all([dependency in self.finished for dependency in task[3]])]:
+                    pending.remove(task)
+
+                    worker = task[2](*[self.results[dependency] for dependency in task[3]])
+                    worker.on_progress = lambda worker: self.report_progress()
+                    worker.on_finished = lambda worker, task = task: self.task_finished(task, worker)
+
+                    self.running[task[0]] = worker
+                    worker.start()
 
-    def run(self):        
-        kittykecore.download_ubuntu_kernel_file(self._kernel, self._index, self._redownload)
+                # Report the tasks, which were just started
+                self.report_progress(force = True)
 
+                # Nothing running, but still tasks left? Then their dependencies will never be finished
+                if len(self.running) == 0:
+                    break
 
+                # Wait until a task is finished
+                self._condition.wait()